@@ -1,12 +1,33 @@
-from flask import Flask, request, jsonify, send_file, render_template, send_from_directory
+from flask import (Flask, Response, request, jsonify, send_file, render_template, send_from_directory,
+                   stream_with_context)
 from flask_cors import CORS
 import os
 import uuid
 import json
+import glob
+import hashlib
+import queue
+import shutil
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import logging
 
-from canvas import Course, course_to_json, get_courses_list, test_canvas_connection, CourseParsingError
+from canvas import (Course, course_state_key, get_courses_list, test_canvas_connection, iter_course_json,
+                    write_course_json, load_canvasapi, CourseParsingError, EXPORT_FORMATS, STATE_VERSION)
+from course_state import CourseState
+from courses import CourseIndexes, DEFAULT_LIMIT, MAX_LIMIT
+from files import FileDownloader
+from exports import ExportStore
+from jobs import JobManager
+from search import SearchIndex, credential_scope, DEFAULT_LIMIT as SEARCH_DEFAULT_LIMIT, \
+    MAX_LIMIT as SEARCH_MAX_LIMIT
+from store import Namespace, make_store
+from tables import TABLE_FORMATS, format_available, open_table_writer, write_course_rows
+from cache import ResponseCache
+import metrics
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -29,8 +50,86 @@ def serve_frontend_static(filename):
 DOWNLOAD_DIR = os.path.join(os.path.dirname(__file__), 'downloads')
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
-# Store session data (in production, use proper session management)
-sessions = {}
+# Finished exports, stored once per distinct content and evicted least
+# recently used first once they take up more than EXPORT_STORE_MAX_BYTES
+export_store = ExportStore(
+    os.path.join(DOWNLOAD_DIR, 'store'),
+    max_bytes=int(os.environ.get('EXPORT_STORE_MAX_BYTES', 2 * 1024 ** 3))
+)
+
+# Per-course state of the last export, used for incremental re-parses
+STATE_DIR = os.path.join(os.path.dirname(__file__), 'state')
+os.makedirs(STATE_DIR, exist_ok=True)
+
+# Checkpoints of parses that died partway are resumed for this many seconds
+CHECKPOINT_MAX_AGE = int(os.environ.get('CHECKPOINT_MAX_AGE', 86400))
+
+# Whether the web interface follows parses over Server-Sent Events. Each
+# open stream holds a server thread for the whole parse, so it is only worth
+# it with an async worker class or many more threads than parsing users;
+# otherwise the interface polls the job
+EVENT_STREAMS = os.environ.get('EVENT_STREAMS', 'false').lower() == 'true'
+
+# Number of concurrent Canvas requests used while parsing a single course
+MAX_WORKERS = int(os.environ.get('CANVAS_MAX_WORKERS', 8))
+
+# Local cache of raw Canvas payloads shared by all parses; a TTL of 0 disables it
+CACHE_TTL = int(os.environ.get('CANVAS_CACHE_TTL', 3600))
+response_cache = None
+if CACHE_TTL > 0:
+    response_cache = ResponseCache(
+        os.environ.get('CANVAS_CACHE_PATH', os.path.join(os.path.dirname(__file__), 'cache', 'canvas_cache.sqlite3')),
+        ttl=CACHE_TTL,
+        max_entries=int(os.environ.get('CANVAS_CACHE_MAX_ENTRIES', 100000)),
+        revalidate=os.environ.get('CANVAS_CACHE_REVALIDATE', 'True').lower() == 'true'
+    )
+
+# Courses of a batch export parsed at the same time; their requests share
+# the credential's connection pool and rate limit scheduler
+BATCH_COURSE_WORKERS = int(os.environ.get('BATCH_COURSE_WORKERS', 4))
+
+# Server-wide cap on the bytes of files one parse may download (0 for none)
+FILE_MAX_BYTES = int(os.environ.get('FILE_DOWNLOAD_MAX_BYTES', 1024 ** 3))
+
+# Sessions and job state shared by every worker using the same store;
+# 'memory' keeps them in this process, 'sqlite' shares them across workers
+shared_store = make_store(
+    os.environ.get('SHARED_STORE', 'memory'),
+    os.environ.get('SHARED_STORE_PATH', os.path.join(STATE_DIR, 'shared.sqlite3'))
+)
+
+# Full-text index of every parsed item, filled module by module as parses run
+search_index = SearchIndex(os.environ.get('SEARCH_INDEX_PATH', os.path.join(STATE_DIR, 'search.sqlite3')))
+
+# Seconds between keep-alive comments on an idle event stream, so proxies
+# don't close it while a large module is being crawled
+SSE_HEARTBEAT_SECONDS = 15
+
+# How often an event stream reads the state of a job another worker runs
+SSE_POLL_SECONDS = 0.5
+
+# Background pool running course parses; the HTTP request only queues them
+jobs = JobManager(max_workers=int(os.environ.get('PARSE_JOB_WORKERS', 2)), store=shared_store,
+                  heartbeat_seconds=int(os.environ.get('JOB_HEARTBEAT_SECONDS', 60)))
+
+# Canvas credentials by session id, dropped SESSION_TTL seconds after login.
+# Session ids are stored hashed; the token has to be read back to call
+# Canvas, so it is stored as is (see DEPLOYMENT.md)
+sessions = Namespace(shared_store, 'sessions', ttl=int(os.environ.get('SESSION_TTL', 86400)), hash_keys=True)
+
+# Course lists per credential, loaded in the background and paged from memory
+course_indexes = CourseIndexes(Namespace(shared_store, 'course_lists', ttl=86400))
+
+# canvasapi is the slowest import of the app. Under gunicorn --preload
+# (GUNICORN_PRELOAD=true, see gunicorn.conf.py) the master process imports it
+# once and every worker is forked with it loaded; a thread must not be
+# running an import at fork time, so it is imported right here. Otherwise
+# each worker imports it in the background while already serving requests,
+# and it is usually loaded before the first login needs it.
+if os.environ.get('GUNICORN_PRELOAD', 'false').lower() == 'true':
+    load_canvasapi()
+else:
+    threading.Thread(target=load_canvasapi, name='canvasapi-import', daemon=True).start()
 
 @app.route('/')
 def index():
@@ -60,13 +159,14 @@ def test_connection():
             sessions[session_id] = {
                 'api_url': api_url,
                 'api_key': api_key,
-                'created_at': datetime.now()
+                'created_at': datetime.now().isoformat()
             }
             
             return jsonify({
                 'success': True,
                 'message': message,
-                'session_id': session_id
+                'session_id': session_id,
+                'event_streams': EVENT_STREAMS
             })
         else:
             return jsonify({
@@ -83,7 +183,13 @@ def test_connection():
 
 @app.route('/api/courses', methods=['GET'])
 def get_courses():
-    """Get list of courses for the authenticated user"""
+    """Get one page of the authenticated user's courses
+
+    Takes page (from 1), limit, search (matched against name and code) and
+    state (comma-separated workflow states). The course list loads in the
+    background, so early pages return before Canvas has sent every course;
+    total stays null until it has.
+    """
     try:
         session_id = request.headers.get('Session-Id')
         if not session_id or session_id not in sessions:
@@ -92,15 +198,36 @@ def get_courses():
                 'message': 'Invalid session. Please authenticate first.'
             }), 401
         
+        try:
+            page = int(request.args.get('page', 1))
+            limit = int(request.args.get('limit', DEFAULT_LIMIT))
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'message': 'page and limit must be integers'
+            }), 400
+        if page < 1 or not 1 <= limit <= MAX_LIMIT:
+            return jsonify({
+                'success': False,
+                'message': f'page must be at least 1 and limit between 1 and {MAX_LIMIT}'
+            }), 400
+        search = request.args.get('search', '').strip() or None
+        states = [state for state in request.args.get('state', '').split(',') if state] or None
+        
         session_data = sessions[session_id]
         api_url = session_data['api_url']
         api_key = session_data['api_key']
         
-        courses = get_courses_list(api_url, api_key)
+        index = course_indexes.get(api_url, api_key)
+        courses, total, has_more = index.query((page - 1) * limit, limit, search, states)
         
         return jsonify({
             'success': True,
-            'courses': courses
+            'courses': courses,
+            'page': page,
+            'limit': limit,
+            'total': total,
+            'has_more': has_more
         })
         
     except CourseParsingError as e:
@@ -115,9 +242,409 @@ def get_courses():
             'message': f'Failed to get courses: {str(e)}'
         }), 500
 
+def state_path(api_url, api_key, course_id):
+    key = course_state_key(api_url, api_key, course_id)
+    return os.path.join(STATE_DIR, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.sqlite3')
+
+def partial_state_path(path):
+    """A private state file for one parse, kept as a checkpoint if the parse dies"""
+    return f"{os.path.splitext(path)[0]}.{uuid.uuid4().hex}.partial.sqlite3"
+
+def remove_state_file(path):
+    for file_path in (path, f"{path}-journal"):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+def claim_checkpoints(path, work):
+    """Merge the checkpoints of earlier parses that died partway into work
+
+    Checkpoints still held by a running parse are left alone, and those
+    older than CHECKPOINT_MAX_AGE are only removed. Returns whether any
+    items were merged.
+    """
+    merged = False
+    for checkpoint in glob.glob(f"{glob.escape(os.path.splitext(path)[0])}.*.partial.sqlite3"):
+        state = CourseState.claim(checkpoint)
+        if state is None:
+            continue
+        try:
+            if time.time() - os.path.getmtime(checkpoint) <= CHECKPOINT_MAX_AGE and state.version == STATE_VERSION:
+                work.merge(state)
+                merged = True
+        finally:
+            state.close()
+        remove_state_file(checkpoint)
+    return merged
+
+# Download MIME type by export file extension
+EXPORT_MIMETYPES = {
+    '.json': 'application/json',
+    '.ndjson': 'application/x-ndjson',
+    '.zip': 'application/zip',
+    '.sqlite': 'application/vnd.sqlite3',
+    '.parquet': 'application/vnd.apache.parquet'
+}
+
+def export_format_error(export_format, file_options=None):
+    """Why a parse can't produce export_format, or None if it can"""
+    formats = EXPORT_FORMATS + tuple(TABLE_FORMATS)
+    if export_format not in formats:
+        return f"Format must be one of: {', '.join(formats)}"
+    if not format_available(export_format):
+        return f"The {export_format} format needs the pyarrow package, which isn't installed"
+    if export_format in TABLE_FORMATS and file_options is not None:
+        return 'Files can only be downloaded with the json, compact and ndjson formats'
+    return None
+
+def file_options_from(data):
+    """Read the optional file download settings of a parse request
+
+    Returns None when files aren't wanted, else FileDownloader keyword
+    arguments. Raises ValueError for malformed settings.
+    """
+    if not data.get('download_files'):
+        return None
+    options = {}
+    file_types = data.get('file_types')
+    if file_types is not None:
+        if not isinstance(file_types, list) or not all(isinstance(t, str) for t in file_types):
+            raise ValueError('file_types must be a list of MIME types such as "application/pdf" or "image/*"')
+        options['types'] = file_types
+    if data.get('max_bytes') is not None:
+        max_bytes = int(data['max_bytes'])
+        # FileDownloader reads 0 as "no limit", which would lift the server's cap
+        if max_bytes < 1:
+            raise ValueError('max_bytes must be a positive number of bytes')
+        # Requests can lower the server's download budget but never raise it
+        options['max_bytes'] = min(max_bytes, FILE_MAX_BYTES) if FILE_MAX_BYTES else max_bytes
+    return options
+
+def export_course_file(course_id, api_url, api_key, incremental=True, export_format='json',
+                       on_progress=None, directory=DOWNLOAD_DIR, file_options=None, on_module=None,
+                       table_writer=None, retry_failed=False):
+    """Parse a course into an export file in directory and return its summary
+
+    With file_options the course's files are downloaded too, under
+    directory/files/<course_id>/, and counted in the summary. on_module is
+    called with each module's dict as soon as it is parsed. Given an open
+    table_writer, the course's rows are appended to it instead of a file of
+    their own, and the summary's filename is None. Every module is also
+    added to the search index, and the course's previous entries are
+    replaced once the parse succeeds.
+    
+    Finished items are checkpointed while the course is crawled and when
+    the parse fails, and the next incremental parse of the course resumes
+    from the checkpoint, fetching again any item whose content has changed
+    since. With retry_failed every item of the last export is kept as it
+    was unless its content has changed, so only the items that failed then
+    are fetched again.
+    """
+    course_state_path = state_path(api_url, api_key, course_id)
+    previous_state = CourseState.open(course_state_path) if incremental or retry_failed else None
+    # This parse's items go to a file of its own, which becomes the course's
+    # state once the parse succeeds and stays behind as its checkpoint if not
+    work_path = partial_state_path(course_state_path)
+    work = CourseState(work_path, exclusive=True)
+    work.start(STATE_VERSION, course_id)
+    # A full parse exports what Canvas has now, so it doesn't resume
+    resumed = claim_checkpoints(course_state_path, work) if incremental or retry_failed else False
+    if retry_failed and previous_state is not None and previous_state.version == STATE_VERSION:
+        work.merge(previous_state)
+        resumed = True
+    if resumed:
+        work.commit()
+        logger.info(f"Resuming course {course_id} with {len(work.items)} finished items")
+    
+    downloader = None
+    if file_options is not None:
+        downloader = FileDownloader(os.path.join(directory, 'files'), api_key=api_key, **file_options)
+    course = None
+    indexer = None
+    
+    try:
+        course = Course(course_id, api_url, api_key, max_workers=MAX_WORKERS, on_progress=on_progress,
+                        cache=response_cache, previous_state=previous_state, lazy=True, files=downloader,
+                        resume_state=work if resumed else None, state=work)
+        if downloader is not None:
+            downloader.timer = course.timings
+        
+        indexer = search_index.course_writer(credential_scope(api_url, api_key), course_id, course.course.name)
+        def on_module_parsed(module_dict):
+            indexer.add_module(module_dict)
+            if on_module is not None:
+                on_module(module_dict)
+        
+        if table_writer is not None:
+            filename = None
+            counts = write_course_rows(course, table_writer, on_module_parsed)
+        else:
+            # Generate filename
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            course_name = course.course.name.replace(' ', '_').replace('/', '_')
+            extension = TABLE_FORMATS.get(export_format, '.ndjson' if export_format == 'ndjson' else '.json')
+            filename = f"course_{course_name}_{timestamp}{extension}"
+            file_path = os.path.join(directory, filename)
+            
+            # Stream modules to a temp file as they are parsed, then publish it
+            tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+            try:
+                if export_format in TABLE_FORMATS:
+                    writer = open_table_writer(export_format, tmp_path)
+                    try:
+                        counts = write_course_rows(course, writer, on_module_parsed)
+                    finally:
+                        writer.close()
+                else:
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        counts = write_course_json(course, f, export_format, on_module_parsed)
+                os.replace(tmp_path, file_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+    except Exception:
+        if indexer is not None:
+            indexer.abort()
+        if table_writer is not None:
+            # Rows written so far would otherwise stay in the shared file
+            try:
+                table_writer.abort_course(course_id)
+            except Exception as e:
+                logger.warning(f"Error removing rows of course {course_id} from {table_writer.path}: {e}")
+        # Keep what this attempt finished for the next one
+        try:
+            if course is not None:
+                course.save_state()
+            work.commit()
+            finished = len(work.items)
+            work.close()
+            if not finished:
+                remove_state_file(work_path)
+        except Exception as e:
+            logger.warning(f"Error saving checkpoint for course {course_id}: {e}")
+        raise
+    finally:
+        if downloader is not None:
+            downloader.close()
+        if previous_state is not None:
+            previous_state.close()
+    
+    indexer.commit()
+    timings = course.timings.breakdown()
+    logger.info(f"Course {course_id} parsed in {timings['total_seconds']}s. File saved: {filename or table_writer.path}")
+    
+    try:
+        course.save_state()
+        # Items merged from checkpoints that the course no longer lists
+        work.prune()
+        work.commit()
+        # Renamed while still locked so no other parse claims it meanwhile
+        os.replace(work_path, course_state_path)
+        work.close()
+        remove_state_file(f"{work_path}-journal")
+    except Exception as e:
+        logger.warning(f"Error saving state for course {course_id}: {e}")
+        work.close()
+        remove_state_file(work_path)
+    if course.failed_items:
+        logger.warning(f"Course {course_id}: {len(course.failed_items)} items failed")
+    
+    summary = {
+        'course_id': course_id,
+        'filename': filename,
+        'course_name': course.course.name,
+        'modules_count': counts['modules_count'],
+        'total_items': counts['total_items'],
+        'reused_items': course.progress['items_reused'],
+        'failed_items': course.failed_items,
+        'cache': course.cache_stats,
+        'timings': timings
+    }
+    if downloader is not None:
+        summary['files'] = dict(downloader.stats)
+    return summary
+
+def archive_course_export(archive, directory, summary, prefix=''):
+    """Move a course's export file and downloaded files into a zip archive
+
+    The export is stored as prefix + its filename, and files keep the
+    files/<course_id>/ paths the export refers to them by.
+    """
+    export_path = os.path.join(directory, summary['filename'])
+    summary['filename'] = prefix + summary['filename']
+    archive.write(export_path, summary['filename'])
+    os.remove(export_path)
+    
+    files_dir = os.path.join(directory, 'files', str(summary['course_id']))
+    if os.path.isdir(files_dir):
+        for name in sorted(os.listdir(files_dir)):
+            path = os.path.join(files_dir, name)
+            # Course files are mostly compressed already (PDF, Office, images)
+            archive.write(path, f"files/{summary['course_id']}/{name}", compress_type=zipfile.ZIP_STORED)
+            os.remove(path)
+        os.rmdir(files_dir)
+
+def publish_export(path, filename):
+    """Move a finished export into the export store
+
+    Returns (content_hash, download_url); the URL names this export alone,
+    so exports sharing a file name never overwrite each other's downloads.
+    """
+    content_hash, download_id, deduplicated = export_store.add(path, filename)
+    if deduplicated:
+        logger.info(f"Export {filename} matches stored export {content_hash}")
+    return content_hash, f"/api/download/{download_id}/{filename}"
+
+def publish_module(job, module_dict):
+    """Send a parsed module and its items to the job's event stream listeners"""
+    jobs.publish(job, 'module', {'title': module_dict['title'], 'items_count': len(module_dict['items'])},
+                 replay=True)
+    for item_dict in module_dict['items']:
+        jobs.publish(job, 'item', {'module': module_dict['title'], **item_dict})
+
+def parse_job_key(api_url, api_key, course_id, incremental, retry_failed, export_format, file_options):
+    """Parses of the same course with the same credentials and options share one job"""
+    return JobManager.make_key(api_url, api_key, course_id, incremental, retry_failed, export_format,
+                               json.dumps(file_options, sort_keys=True))
+
+def run_parse_job(job, course_id, api_url, api_key, incremental=True, export_format='json', file_options=None,
+                  retry_failed=False):
+    """Parse a course, save the JSON file and return the summary shown to the user
+
+    When files are downloaded too, the export and the files are returned
+    together as one zip archive.
+    """
+    logger.info(f"Starting to parse course {course_id} (job {job.id})")
+    on_progress = lambda progress: jobs.update_progress(job, progress)
+    work_dir = os.path.join(DOWNLOAD_DIR, f"job_{job.id}.tmp")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        summary = export_course_file(course_id, api_url, api_key, incremental, export_format, on_progress,
+                                     work_dir, file_options, retry_failed=retry_failed,
+                                     on_module=lambda module_dict: publish_module(job, module_dict))
+        if file_options is not None:
+            filename = os.path.splitext(summary['filename'])[0] + '.zip'
+            with zipfile.ZipFile(os.path.join(work_dir, filename), 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                archive_course_export(archive, work_dir, summary)
+            summary['filename'] = filename
+        summary['content_hash'], summary['download_url'] = publish_export(
+            os.path.join(work_dir, summary['filename']), summary['filename'])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    del summary['course_id']
+    return summary
+
+def run_batch_job(job, course_ids, api_url, api_key, incremental=True, export_format='json', file_options=None,
+                  retry_failed=False):
+    """Export many courses into one zip archive with a manifest
+
+    Up to BATCH_COURSE_WORKERS courses are parsed at once, in the order
+    given. Each finished export is moved into the archive straight away, so
+    only the courses in flight take up space outside it. A course that fails
+    is listed in the manifest with its error instead of failing the batch.
+    Table formats append every course to one SQLite or Parquet file instead
+    of an archive; the manifest is then only part of the result.
+    """
+    if course_ids == 'all':
+        course_ids = [course['id'] for course in get_courses_list(api_url, api_key)]
+    logger.info(f"Starting batch export of {len(course_ids)} courses (job {job.id})")
+    
+    progress_lock = threading.Lock()
+    course_progress = {}
+    totals = {'courses_total': len(course_ids), 'courses_done': 0, 'courses_failed': 0}
+    
+    def report(course_id=None, progress=None, **counts):
+        with progress_lock:
+            if course_id is not None:
+                course_progress[course_id] = progress
+            for key, value in counts.items():
+                totals[key] += value
+            snapshot = dict(totals)
+            for key in ('modules_total', 'modules_done', 'items_total', 'items_done', 'items_reused'):
+                snapshot[key] = sum(p.get(key, 0) for p in course_progress.values())
+        jobs.update_progress(job, snapshot)
+    
+    report()
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = f"batch_{len(course_ids)}_courses_{timestamp}{TABLE_FORMATS.get(export_format, '.zip')}"
+    work_dir = os.path.join(DOWNLOAD_DIR, f"batch_{job.id}.tmp")
+    os.makedirs(work_dir, exist_ok=True)
+    archive_path = os.path.join(work_dir, filename)
+    manifest = {
+        'format': export_format,
+        'created_at': datetime.now().isoformat(),
+        'courses': [],
+        'failed': []
+    }
+    
+    def export_course(course_id, table_writer):
+        # Each course gets its own directory: sections and terms often share
+        # a course name, and so would their export file names
+        course_dir = os.path.join(work_dir, str(course_id))
+        os.makedirs(course_dir, exist_ok=True)
+        return export_course_file(course_id, api_url, api_key, incremental, export_format,
+                                  lambda progress: report(course_id, progress), course_dir, file_options,
+                                  table_writer=table_writer, retry_failed=retry_failed)
+    
+    def run_courses(archive=None, table_writer=None):
+        with ThreadPoolExecutor(max_workers=BATCH_COURSE_WORKERS, thread_name_prefix='batch-course') as executor:
+            futures = {
+                executor.submit(export_course, course_id, table_writer): course_id
+                for course_id in course_ids
+            }
+            for future in as_completed(futures):
+                course_id = futures[future]
+                try:
+                    summary = future.result()
+                    if archive is not None:
+                        # Course names repeat across terms, so prefix entries with the id
+                        archive_course_export(archive, os.path.join(work_dir, str(course_id)), summary,
+                                              prefix=f"{course_id}_")
+                except Exception as e:
+                    logger.error(f"Batch job {job.id}: course {course_id} failed: {e}")
+                    manifest['failed'].append({'course_id': course_id, 'error': str(e)})
+                    report(courses_failed=1)
+                    continue
+                finally:
+                    shutil.rmtree(os.path.join(work_dir, str(course_id)), ignore_errors=True)
+                manifest['courses'].append(summary)
+                report(courses_done=1)
+        
+        order = {course_id: index for index, course_id in enumerate(course_ids)}
+        manifest['courses'].sort(key=lambda summary: order[summary['course_id']])
+        manifest['failed'].sort(key=lambda failure: order[failure['course_id']])
+    
+    try:
+        if export_format in TABLE_FORMATS:
+            table_writer = open_table_writer(export_format, archive_path)
+            try:
+                run_courses(table_writer=table_writer)
+            finally:
+                table_writer.close()
+        else:
+            with zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                run_courses(archive=archive)
+                archive.writestr('manifest.json', json.dumps(manifest, indent=2))
+        content_hash, download_url = publish_export(archive_path, filename)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    logger.info(f"Batch export completed. File saved: {filename}")
+    
+    return {
+        'filename': filename,
+        'download_url': download_url,
+        'content_hash': content_hash,
+        'courses_count': len(manifest['courses']),
+        'failed_count': len(manifest['failed']),
+        'modules_count': sum(summary['modules_count'] for summary in manifest['courses']),
+        'total_items': sum(summary['total_items'] for summary in manifest['courses']),
+        'items_failed': sum(len(summary['failed_items']) for summary in manifest['courses']),
+        'manifest': manifest
+    }
+
 @app.route('/api/parse-course', methods=['POST'])
 def parse_course():
-    """Parse a selected course and generate JSON file"""
+    """Queue a course parse and return the job id to poll"""
     try:
         session_id = request.headers.get('Session-Id')
         if not session_id or session_id not in sessions:
@@ -128,65 +655,389 @@ def parse_course():
         
         data = request.get_json()
         course_id = data.get('course_id')
+        # Reuse unchanged items from the last export unless asked not to
+        incremental = bool(data.get('incremental', True))
+        # Only fetch the items that failed in the last export
+        retry_failed = bool(data.get('retry_failed', False))
+        export_format = data.get('format', 'json')
+        try:
+            file_options = file_options_from(data)
+        except (TypeError, ValueError) as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
         
         if not course_id:
             return jsonify({
                 'success': False,
                 'message': 'Course ID is required'
             }), 400
+        try:
+            # Same key and Parquet course_id column as the events route and batch exports
+            course_id = int(course_id)
+        except (TypeError, ValueError):
+            return jsonify({
+                'success': False,
+                'message': 'Course ID must be an integer'
+            }), 400
+        
+        format_error = export_format_error(export_format, file_options)
+        if format_error:
+            return jsonify({
+                'success': False,
+                'message': format_error
+            }), 400
         
         session_data = sessions[session_id]
         api_url = session_data['api_url']
         api_key = session_data['api_key']
         
-        # Parse the course
-        logger.info(f"Starting to parse course {course_id}")
-        course = Course(course_id, api_url, api_key)
+        job, created = jobs.submit(
+            parse_job_key(api_url, api_key, course_id, incremental, retry_failed, export_format, file_options),
+            lambda job: run_parse_job(job, course_id, api_url, api_key, incremental, export_format, file_options,
+                                      retry_failed)
+        )
         
-        # Convert to JSON
-        course_json = course_to_json(course)
+        return jsonify({
+            'success': True,
+            'message': 'Course parse started' if created else 'Course parse already in progress',
+            'job_id': job.id,
+            'status_url': f'/api/jobs/{job.id}'
+        }), 202
         
-        # Generate filename
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        course_name = course.course.name.replace(' ', '_').replace('/', '_')
-        filename = f"course_{course_name}_{timestamp}.json"
-        file_path = os.path.join(DOWNLOAD_DIR, filename)
+    except Exception as e:
+        logger.error(f"Error starting course parse: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'Failed to parse course: {str(e)}'
+        }), 500
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_job_events(job_id):
+    """Yield a parse job's progress as SSE events until it finishes
+
+    Starts with a job event carrying the job id, so a client that loses
+    the stream can poll the job instead. A job running in this process
+    sends a module event (with those parsed before the client joined)
+    followed by an item event per item as each module is parsed, and
+    progress events with the job's counters. A job another worker runs
+    only sends progress events, read from the shared store. Ends with done
+    carrying the job's summary, or error.
+    """
+    yield sse_event('job', {'job_id': job_id, 'status_url': f'/api/jobs/{job_id}'})
+    events = jobs.listen(job_id)
+    if events is not None:
+        try:
+            while True:
+                try:
+                    event = events.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                if event is None:
+                    break
+                yield sse_event(*event)
+        finally:
+            jobs.stop_listening(job_id, events)
+    else:
+        progress = None
+        idle = 0.0
+        while True:
+            job = jobs.get(job_id)
+            if job is None or job.finished:
+                break
+            if job.progress != progress:
+                progress = job.progress
+                idle = 0.0
+                yield sse_event('progress', progress)
+            elif idle >= SSE_HEARTBEAT_SECONDS:
+                idle = 0.0
+                yield ': keep-alive\n\n'
+            time.sleep(SSE_POLL_SECONDS)
+            idle += SSE_POLL_SECONDS
+    
+    job = jobs.get(job_id)
+    if job is None:
+        yield sse_event('error', {'message': 'Job not found or expired'})
+    elif job.state == 'completed':
+        yield sse_event('done', job.result)
+    else:
+        yield sse_event('error', {'message': job.error})
+
+@app.route('/api/parse-course/<int:course_id>/events', methods=['GET'])
+def parse_course_events(course_id):
+    """Parse a course while streaming its modules and items as Server-Sent Events"""
+    try:
+        session_id = request.headers.get('Session-Id')
+        if not session_id or session_id not in sessions:
+            return jsonify({
+                'success': False,
+                'message': 'Invalid session. Please authenticate first.'
+            }), 401
+        
+        incremental = request.args.get('incremental', 'true').lower() == 'true'
+        retry_failed = request.args.get('retry_failed', 'false').lower() == 'true'
+        export_format = request.args.get('format', 'json')
+        format_error = export_format_error(export_format)
+        if format_error:
+            return jsonify({
+                'success': False,
+                'message': format_error
+            }), 400
+        
+        session_data = sessions[session_id]
+        api_url = session_data['api_url']
+        api_key = session_data['api_key']
+        
+        # The same job as POST /api/parse-course, so the two deduplicate
+        # against each other and share the PARSE_JOB_WORKERS pool
+        job, created = jobs.submit(
+            parse_job_key(api_url, api_key, course_id, incremental, retry_failed, export_format, None),
+            lambda job: run_parse_job(job, course_id, api_url, api_key, incremental, export_format, None,
+                                      retry_failed)
+        )
+        if not created:
+            logger.info(f"Event stream for course {course_id} joined running job {job.id}")
+        return Response(
+            stream_job_events(job.id),
+            mimetype='text/event-stream',
+            # Keep reverse proxies from buffering the stream
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        
+    except Exception as e:
+        logger.error(f"Error starting event stream for course {course_id}: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'Failed to parse course: {str(e)}'
+        }), 500
+
+@app.route('/api/batch-export', methods=['POST'])
+def batch_export():
+    """Queue an export of many courses, or all of the user's courses, as one archive"""
+    try:
+        session_id = request.headers.get('Session-Id')
+        if not session_id or session_id not in sessions:
+            return jsonify({
+                'success': False,
+                'message': 'Invalid session. Please authenticate first.'
+            }), 401
+        
+        data = request.get_json()
+        course_ids = data.get('course_ids')
+        incremental = bool(data.get('incremental', True))
+        retry_failed = bool(data.get('retry_failed', False))
+        export_format = data.get('format', 'json')
+        try:
+            file_options = file_options_from(data)
+        except (TypeError, ValueError) as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        
+        if course_ids != 'all':
+            if not isinstance(course_ids, list) or not course_ids:
+                return jsonify({
+                    'success': False,
+                    'message': 'course_ids must be a list of course IDs or "all"'
+                }), 400
+            try:
+                # Keep the given order but drop repeats
+                course_ids = list(dict.fromkeys(int(course_id) for course_id in course_ids))
+            except (TypeError, ValueError):
+                return jsonify({
+                    'success': False,
+                    'message': 'course_ids must be a list of course IDs or "all"'
+                }), 400
+        
+        format_error = export_format_error(export_format, file_options)
+        if format_error:
+            return jsonify({
+                'success': False,
+                'message': format_error
+            }), 400
+        
+        session_data = sessions[session_id]
+        api_url = session_data['api_url']
+        api_key = session_data['api_key']
+        
+        job, created = jobs.submit(
+            JobManager.make_key('batch', api_url, api_key, course_ids, incremental, retry_failed, export_format,
+                                json.dumps(file_options, sort_keys=True)),
+            lambda job: run_batch_job(job, course_ids, api_url, api_key, incremental, export_format, file_options,
+                                      retry_failed)
+        )
         
-        # Save JSON file
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(course_json)
+        return jsonify({
+            'success': True,
+            'message': 'Batch export started' if created else 'Batch export already in progress',
+            'job_id': job.id,
+            'status_url': f'/api/jobs/{job.id}'
+        }), 202
+        
+    except Exception as e:
+        logger.error(f"Error starting batch export: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'Failed to start batch export: {str(e)}'
+        }), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Report the state and progress of a parse job"""
+    try:
+        session_id = request.headers.get('Session-Id')
+        if not session_id or session_id not in sessions:
+            return jsonify({
+                'success': False,
+                'message': 'Invalid session. Please authenticate first.'
+            }), 401
         
-        logger.info(f"Course parsing completed. File saved: {filename}")
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify({
+                'success': False,
+                'message': 'Job not found'
+            }), 404
         
         return jsonify({
             'success': True,
-            'message': 'Course parsed successfully',
-            'filename': filename,
-            'download_url': f'/api/download/{filename}',
-            'course_name': course.course.name,
-            'modules_count': len(course.modules),
-            'total_items': sum(len(module.items) for module in course.modules)
+            **job.to_dict()
         })
         
+    except Exception as e:
+        logger.error(f"Error getting job {job_id}: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'Failed to get job: {str(e)}'
+        }), 500
+
+@app.route('/api/export-course/<int:course_id>', methods=['GET'])
+def export_course(course_id):
+    """Stream a course export straight into the HTTP response"""
+    try:
+        session_id = request.headers.get('Session-Id')
+        if not session_id or session_id not in sessions:
+            return jsonify({
+                'success': False,
+                'message': 'Invalid session. Please authenticate first.'
+            }), 401
+        
+        export_format = request.args.get('format', 'json')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({
+                'success': False,
+                'message': f"Format must be one of: {', '.join(EXPORT_FORMATS)}"
+            }), 400
+        
+        session_data = sessions[session_id]
+        course = Course(course_id, session_data['api_url'], session_data['api_key'],
+                        max_workers=MAX_WORKERS, cache=response_cache, lazy=True)
+        
+        mimetype = 'application/x-ndjson' if export_format == 'ndjson' else 'application/json'
+        return Response(stream_with_context(iter_course_json(course, export_format)), mimetype=mimetype)
+        
     except CourseParsingError as e:
         return jsonify({
             'success': False,
             'message': str(e)
         }), 400
     except Exception as e:
-        logger.error(f"Error parsing course: {e}")
+        logger.error(f"Error exporting course {course_id}: {e}")
         return jsonify({
             'success': False,
-            'message': f'Failed to parse course: {str(e)}'
+            'message': f'Failed to export course: {str(e)}'
+        }), 500
+
+@app.route('/api/search', methods=['GET'])
+def search_items():
+    """Search the items of every course parsed with this session's credentials
+
+    Takes q (every word must match; the last one also as a prefix), page,
+    limit and the optional filters course_id and type (both
+    comma-separated). Results come best match first, each with a snippet
+    of the text that matched.
+    """
+    try:
+        session_id = request.headers.get('Session-Id')
+        if not session_id or session_id not in sessions:
+            return jsonify({
+                'success': False,
+                'message': 'Invalid session. Please authenticate first.'
+            }), 401
+        
+        text = request.args.get('q', '').strip()
+        if not text:
+            return jsonify({
+                'success': False,
+                'message': 'Search text (q) is required'
+            }), 400
+        try:
+            page = int(request.args.get('page', 1))
+            limit = int(request.args.get('limit', SEARCH_DEFAULT_LIMIT))
+            course_ids = [int(course_id) for course_id in request.args.get('course_id', '').split(',') if course_id]
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'message': 'page, limit and course_id must be integers'
+            }), 400
+        if page < 1 or not 1 <= limit <= SEARCH_MAX_LIMIT:
+            return jsonify({
+                'success': False,
+                'message': f'page must be at least 1 and limit between 1 and {SEARCH_MAX_LIMIT}'
+            }), 400
+        types = [item_type for item_type in request.args.get('type', '').split(',') if item_type]
+        
+        session_data = sessions[session_id]
+        scope = credential_scope(session_data['api_url'], session_data['api_key'])
+        results, has_more = search_index.search(scope, text, (page - 1) * limit, limit, course_ids, types)
+        
+        return jsonify({
+            'success': True,
+            'results': results,
+            'page': page,
+            'limit': limit,
+            'has_more': has_more,
+            'indexed': search_index.stats(scope)
+        })
+        
+    except Exception as e:
+        logger.error(f"Error searching items: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'Search failed: {str(e)}'
         }), 500
 
+@app.route('/api/cache', methods=['GET'])
+def cache_stats():
+    """Report hit/miss counts of the Canvas response cache"""
+    if response_cache is None:
+        return jsonify({
+            'success': True,
+            'enabled': False
+        })
+    
+    return jsonify({
+        'success': True,
+        'enabled': True,
+        **response_cache.stats()
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Expose API call counters and stage latency histograms for Prometheus"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/api/download/<filename>')
-def download_file(filename):
-    """Download generated JSON file"""
+def download_legacy_file(filename):
+    """Download a file saved straight into the downloads folder by older versions"""
     try:
         file_path = os.path.join(DOWNLOAD_DIR, filename)
-        
-        if not os.path.exists(file_path):
+        if not os.path.isfile(file_path):
             return jsonify({
                 'success': False,
                 'message': 'File not found'
@@ -196,8 +1047,48 @@ def download_file(filename):
             file_path,
             as_attachment=True,
             download_name=filename,
-            mimetype='application/json'
+            mimetype=EXPORT_MIMETYPES.get(os.path.splitext(filename)[1], 'application/json')
+        )
+        
+    except Exception as e:
+        logger.error(f"Error downloading file: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'Download failed: {str(e)}'
+        }), 500
+
+@app.route('/api/download/<download_id>/<filename>')
+def download_file(download_id, filename):
+    """Download a generated export by the id it was published under
+
+    Stored exports carry their content hash as ETag, so a client that
+    already has the file gets a 304, and come pre-compressed when the
+    client accepts gzip or br.
+    """
+    try:
+        accepted = [encoding for encoding, quality in request.accept_encodings if quality > 0]
+        stored = export_store.open(download_id, accepted)
+        if stored is None or stored['filename'] != filename:
+            return jsonify({
+                'success': False,
+                'message': 'File not found'
+            }), 404
+        
+        mimetype = EXPORT_MIMETYPES.get(os.path.splitext(filename)[1], 'application/json')
+        # Each encoding is a different representation and needs its own ETag
+        etag = stored['hash'] if stored['encoding'] is None else f"{stored['hash']}-{stored['encoding']}"
+        response = send_file(
+            stored['path'],
+            as_attachment=True,
+            download_name=filename,
+            mimetype=mimetype,
+            etag=etag,
+            conditional=True
         )
+        if stored['encoding'] is not None:
+            response.headers['Content-Encoding'] = stored['encoding']
+        response.vary.add('Accept-Encoding')
+        return response
         
     except Exception as e:
         logger.error(f"Error downloading file: {e}")
@@ -206,13 +1097,23 @@ def download_file(filename):
             'message': f'Download failed: {str(e)}'
         }), 500
 
+@app.route('/api/exports', methods=['GET'])
+def export_store_stats():
+    """Report the size and deduplication counts of the export store"""
+    return jsonify({
+        'success': True,
+        **export_store.stats()
+    })
+
 @app.route('/api/cleanup', methods=['POST'])
 def cleanup_session():
     """Clean up session data"""
     try:
         session_id = request.headers.get('Session-Id')
-        if session_id and session_id in sessions:
+        session_data = sessions.get(session_id) if session_id else None
+        if session_data is not None:
             del sessions[session_id]
+            course_indexes.drop(session_data['api_url'], session_data['api_key'])
         
         return jsonify({
             'success': True,
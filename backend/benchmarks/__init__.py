@@ -0,0 +1 @@
+"""Performance benchmarks for the course parser against a local fake Canvas"""
@@ -0,0 +1,320 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+import glob
+import json
+import os
+import re
+import threading
+import time
+
+SAMPLE_GLOB = os.path.join(os.path.dirname(__file__), '..', 'downloads', 'course_*.json')
+
+# Module item types the parser understands, in the order the uniform mix cycles them
+ITEM_TYPES = ('Assignment', 'Quiz', 'File', 'Page', 'Discussion')
+
+# Canvas caps per_page at 100 and defaults to 10
+MAX_PER_PAGE = 100
+DEFAULT_PER_PAGE = 10
+
+# Canvas's leaky bucket: every request is charged PREFLIGHT_PENALTY up front
+# (refunded when it completes) and its cost afterwards, while the bucket
+# drains at LEAK_RATE units per second. Requests that would overflow the
+# quota are refused with 403 Rate Limit Exceeded.
+PREFLIGHT_PENALTY = 50
+LEAK_RATE = 10.0
+
+
+def load_sample(path=None):
+    """Load a recorded export from backend/downloads to seed course structure"""
+    if path is None:
+        paths = sorted(glob.glob(SAMPLE_GLOB))
+        if not paths:
+            return None
+        path = paths[0]
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def synthetic_course(course_id=1, modules=None, items=None, body_size=2000, mix='sample', sample=None):
+    """Build the Canvas objects of a synthetic course
+
+    Module titles and the item type sequence are taken from a recorded export
+    (mix='sample') or cycle through every item type (mix='uniform'). Module
+    and per-module item counts default to the sample's own.
+    """
+    sample_modules = (sample or {}).get('modules') or [{'title': 'Module', 'items': [{'type': 'Page'}]}]
+    if modules is None:
+        modules = len(sample_modules)
+    if mix == 'sample':
+        type_cycle = [item['type'] for module in sample_modules for item in module['items']
+                      if item['type'] in ITEM_TYPES] or list(ITEM_TYPES)
+    else:
+        type_cycle = list(ITEM_TYPES)
+
+    filler = '<p>' + ('lorem ipsum dolor sit amet ' * (body_size // 27 + 1))[:body_size] + '</p>'
+    updated_at = '2024-01-01T00:00:00Z'
+    course = {
+        'course': {'id': course_id, 'name': f'Benchmark course {course_id}',
+                   'course_code': f'BENCH-{course_id}', 'workflow_state': 'available'},
+        'modules': [],
+        'Assignment': {}, 'Quiz': {}, 'File': {}, 'Page': {}, 'Discussion': {}
+    }
+
+    content_id = course_id * 1000000
+    item_id = course_id * 1000000
+    position = 0
+    for module_index in range(modules):
+        sample_module = sample_modules[module_index % len(sample_modules)]
+        module_items = items if items is not None else max(1, len(sample_module['items']))
+        module = {'id': course_id * 10000 + module_index + 1, 'name': sample_module['title'],
+                  'position': module_index + 1, 'items': []}
+        for index in range(module_items):
+            item_type = type_cycle[position % len(type_cycle)]
+            position += 1
+            content_id += 1
+            item_id += 1
+            body = f'<div><h2>{item_type} {content_id}</h2>{filler}<script>track()</script></div>'
+            module['items'].append({'id': item_id, 'module_id': module['id'], 'position': index + 1,
+                                    'type': item_type, 'title': f'{item_type} {content_id}',
+                                    'content_id': content_id})
+            if item_type == 'Assignment':
+                course['Assignment'][content_id] = {'id': content_id, 'name': f'Assignment {content_id}',
+                                                    'description': body, 'due_at': '2024-02-01T23:59:00Z',
+                                                    'updated_at': updated_at}
+            elif item_type == 'Quiz':
+                course['Quiz'][content_id] = {'id': content_id, 'title': f'Quiz {content_id}',
+                                              'description': body}
+            elif item_type == 'File':
+                course['File'][content_id] = {'id': content_id, 'display_name': f'file_{content_id}.pdf',
+                                              'url': f'/files/{content_id}/download',
+                                              'content-type': 'application/pdf', 'size': body_size,
+                                              'updated_at': updated_at}
+            elif item_type == 'Page':
+                course['Page'][content_id] = {'page_id': content_id, 'url': f'page-{content_id}',
+                                              'title': f'Page {content_id}', 'body': body,
+                                              'updated_at': updated_at}
+                module['items'][-1]['page_url'] = f'page-{content_id}'
+            elif item_type == 'Discussion':
+                course['Discussion'][content_id] = {'id': content_id, 'title': f'Discussion {content_id}',
+                                                    'message': body}
+        course['modules'].append(module)
+    return course
+
+
+# Course sub-resources listed or fetched by id, keyed by URL segment
+CONTENT_ROUTES = {
+    'assignments': 'Assignment',
+    'quizzes': 'Quiz',
+    'files': 'File',
+    'pages': 'Page',
+    'discussion_topics': 'Discussion',
+}
+
+
+class FakeCanvas:
+    """Threaded local stand-in for the Canvas REST endpoints canvasapi calls
+
+    Every request sleeps for latency seconds and is counted by endpoint
+    pattern, so benchmarks can report API calls alongside wall time. With a
+    quota, requests are metered like Canvas's per-token rate limit and
+    carry X-Request-Cost and X-Rate-Limit-Remaining headers.
+    """
+
+    def __init__(self, courses, latency=0.0, quota=None, request_cost=1.0):
+        self.courses = {course['course']['id']: course for course in courses}
+        self.latency = latency
+        self.quota = quota
+        self.request_cost = request_cost
+        self.bucket = 0.0
+        self.bucket_at = time.monotonic()
+        self.throttled = 0
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.server = None
+        self.url = None
+
+    def start(self, port=0):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in separate writes; without this, Nagle
+            # plus delayed ACKs add ~40ms to every keep-alive response
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                fake.handle(self)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def total_calls(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+    def reset_calls(self):
+        """Forget counted calls and refill the rate limit quota"""
+        with self.lock:
+            self.calls = {}
+            self.bucket = 0.0
+            self.throttled = 0
+
+    def _charge(self, amount):
+        """Drain the bucket, add amount and return the remaining quota"""
+        with self.lock:
+            now = time.monotonic()
+            self.bucket = max(0.0, self.bucket - (now - self.bucket_at) * LEAK_RATE) + amount
+            self.bucket_at = now
+            return self.quota - self.bucket
+
+    def _admit(self):
+        with self.lock:
+            now = time.monotonic()
+            self.bucket = max(0.0, self.bucket - (now - self.bucket_at) * LEAK_RATE)
+            self.bucket_at = now
+            if self.bucket + PREFLIGHT_PENALTY > self.quota:
+                self.throttled += 1
+                return False
+            self.bucket += PREFLIGHT_PENALTY
+            return True
+
+    def _count(self, endpoint):
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def _paginate(self, rows, query, path):
+        per_page = min(int(query.get('per_page', [DEFAULT_PER_PAGE])[0]), MAX_PER_PAGE)
+        page = int(query.get('page', ['1'])[0])
+        headers = {}
+        if page * per_page < len(rows):
+            next_query = dict(query, page=[str(page + 1)], per_page=[str(per_page)])
+            headers['Link'] = f'<{self.url}{path}?{urlencode(next_query, doseq=True)}>; rel="next"'
+        return rows[(page - 1) * per_page:page * per_page], headers
+
+    def _absolute(self, obj):
+        # Canvas hands out file URLs as absolute download links
+        if 'url' in obj and obj['url'].startswith('/files/'):
+            return dict(obj, url=self.url + obj['url'])
+        return obj
+
+    def _send_file(self, handler, file_id):
+        """Serve a file's body; downloads don't count against the API quota"""
+        obj = next((course['File'][file_id] for course in self.courses.values()
+                    if file_id in course['File']), None)
+        if obj is None:
+            handler.send_response(404)
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+            return
+        self._count('file_download')
+        if self.latency:
+            time.sleep(self.latency)
+        handler.send_response(200)
+        handler.send_header('Content-Type', obj['content-type'])
+        handler.send_header('Content-Length', str(obj['size']))
+        handler.end_headers()
+        block = (b'%PDF-1.4 benchmark ' * 64)[:1024]
+        remaining = obj['size']
+        while remaining > 0:
+            handler.wfile.write(block[:remaining])
+            remaining -= len(block)
+
+    def route(self, path, query):
+        """Return (endpoint pattern, status, body, headers) for a GET request"""
+        resource = path[len('/api/v1'):] if path.startswith('/api/v1') else path
+        if resource == '/users/self':
+            return 'users/self', 200, {'id': 1, 'name': 'Benchmark User'}, {}
+        if resource == '/courses':
+            rows, headers = self._paginate([c['course'] for c in self.courses.values()], query, path)
+            return 'courses', 200, rows, headers
+
+        match = re.fullmatch(r'/courses/(\d+)(?:/(.*))?', resource)
+        if not match or int(match.group(1)) not in self.courses:
+            return 'unknown', 404, {'errors': [{'message': 'The specified resource does not exist.'}]}, {}
+        course = self.courses[int(match.group(1))]
+        parts = [part for part in (match.group(2) or '').split('/') if part]
+
+        if not parts:
+            return 'course', 200, course['course'], {}
+        if parts[0] == 'modules':
+            if len(parts) == 1:
+                include_items = 'items' in query.get('include[]', [])
+                rows = [{key: value for key, value in module.items() if include_items or key != 'items'}
+                        for module in course['modules']]
+                rows, headers = self._paginate(rows, query, path)
+                return 'modules', 200, rows, headers
+            module = next((m for m in course['modules'] if str(m['id']) == parts[1]), None)
+            if module is not None:
+                if len(parts) == 2:
+                    return 'module', 200, {k: v for k, v in module.items() if k != 'items'}, {}
+                if len(parts) == 3 and parts[2] == 'items':
+                    rows, headers = self._paginate(module['items'], query, path)
+                    return 'module_items', 200, rows, headers
+                if len(parts) == 4 and parts[2] == 'items':
+                    item = next((i for i in module['items'] if str(i['id']) == parts[3]), None)
+                    if item is not None:
+                        return 'module_item', 200, item, {}
+        elif parts[0] in CONTENT_ROUTES:
+            item_type = CONTENT_ROUTES[parts[0]]
+            objects = course[item_type]
+            if len(parts) == 1:
+                rows = [self._absolute(row) for row in objects.values()]
+                if item_type == 'Page' and 'body' not in query.get('include[]', []):
+                    rows = [{k: v for k, v in row.items() if k != 'body'} for row in rows]
+                rows, headers = self._paginate(rows, query, path)
+                return parts[0], 200, rows, headers
+            if len(parts) == 2:
+                key = parts[1]
+                obj = objects.get(int(key)) if key.isdigit() else None
+                if obj is None and item_type == 'Page':
+                    obj = next((page for page in objects.values() if page['url'] == key), None)
+                if obj is not None:
+                    return parts[0][:-1] if parts[0] != 'quizzes' else 'quiz', 200, self._absolute(obj), {}
+        return 'unknown', 404, {'errors': [{'message': 'The specified resource does not exist.'}]}, {}
+
+    def handle(self, handler):
+        download = re.fullmatch(r'/files/(\d+)/download', urlparse(handler.path).path)
+        if download:
+            self._send_file(handler, int(download.group(1)))
+            return
+
+        if self.quota is not None and not self._admit():
+            self._count('throttled')
+            data = b'403 Forbidden (Rate Limit Exceeded)'
+            handler.send_response(403)
+            handler.send_header('Content-Type', 'text/plain')
+            handler.send_header('Content-Length', str(len(data)))
+            handler.send_header('X-Rate-Limit-Remaining', f'{self._charge(0):.1f}')
+            handler.end_headers()
+            handler.wfile.write(data)
+            return
+
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse(handler.path)
+        endpoint, status, body, headers = self.route(url.path, parse_qs(url.query))
+        self._count(endpoint)
+        if self.quota is not None:
+            remaining = self._charge(self.request_cost - PREFLIGHT_PENALTY)
+            headers = dict(headers, **{'X-Request-Cost': f'{self.request_cost:.1f}',
+                                       'X-Rate-Limit-Remaining': f'{remaining:.1f}'})
+
+        data = json.dumps(body).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
@@ -0,0 +1,65 @@
+"""Check that content edited between two exports is exported as edited
+
+Run from the backend directory:
+
+    python -m benchmarks.freshness
+
+Exports a synthetic course through the response cache, edits one page's
+body and updated_at on the fake Canvas, and exports it again, both in full
+and incrementally from the first export's state. Reports every mode that
+still exports the old body. Exits with status 1 on any stale export.
+"""
+import logging
+import os
+import sys
+import tempfile
+import warnings
+
+from benchmarks.fake_canvas import FakeCanvas, synthetic_course
+from cache import ResponseCache
+from canvas import Course, course_to_json
+from course_state import CourseState
+
+EDITED_TEXT = 'Edited between exports'
+
+
+def export(fake, cache, previous_state=None, state=None):
+    course = Course(1, fake.url, 'freshness-token', max_workers=4, cache=cache, lazy=True,
+                    previous_state=previous_state, state=state)
+    output = course_to_json(course)
+    course.save_state()
+    return output
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    warnings.simplefilter('ignore')
+    course = synthetic_course(1, modules=4, items=6, body_size=200, mix='uniform')
+    fake = FakeCanvas([course]).start()
+    stale = 0
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for incremental in (False, True):
+                for page in course['Page'].values():
+                    page['body'], page['updated_at'] = '<p>Original body</p>', '2024-01-01T00:00:00Z'
+                cache = ResponseCache(os.path.join(directory, f'cache-{incremental}.sqlite3'))
+                state_path = os.path.join(directory, f'state-{incremental}.sqlite3')
+                export(fake, cache, state=CourseState(state_path))
+
+                page = next(iter(course['Page'].values()))
+                page['body'], page['updated_at'] = f'<p>{EDITED_TEXT}</p>', '2024-06-01T00:00:00Z'
+                previous_state = CourseState.open(state_path) if incremental else None
+                output = export(fake, cache, previous_state=previous_state)
+                mode = 'incremental' if incremental else 'full'
+                if EDITED_TEXT not in output:
+                    stale += 1
+                    print(f"{mode} export kept the old body of page {page['page_id']}")
+                else:
+                    print(f"{mode} export: edited page exported as edited")
+    finally:
+        fake.stop()
+    return 1 if stale else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""Check that every HTML backend extracts the same text
+
+Run from the backend directory:
+
+    python -m benchmarks.html_parity
+
+Extracts a set of HTML snippets shaped like Canvas descriptions, plus the
+bodies of a synthetic course, with each installed backend and reports every
+snippet where a backend's text differs from html.parser's, the reference
+the original bs4 extraction used. Exits with status 1 on any difference.
+"""
+import importlib.util
+import sys
+import warnings
+
+from benchmarks.fake_canvas import load_sample, synthetic_course
+from html_text import BACKENDS, extract_text
+
+CASES = [
+    '<div>a<script>x</script>b<style>y</style>c</div>',
+    '<p>Read <link rel="stylesheet" href="x.css">chapter 2</p>',
+    '<p>before<!-- hidden -->after</p>',
+    '<p>one<br>two<br/>three</p>',
+    '<ul><li>first</li><li>second <b>bold</b> tail</li></ul>',
+    '<table><tr><td>cell 1</td><td>cell 2</td></tr></table>',
+    '<p>caf&eacute; &amp; cr&egrave;me&nbsp;br&ucirc;l&eacute;e</p>',
+    '<?xml version="1.0" encoding="utf-8"?><p>declared</p>',
+    '<div><h2>Title</h2><p>text <a href="/x">link</a>.</p><script>track()</script></div>tail',
+    '<!-- only a comment -->',
+    'plain text',
+    '<p>   </p>',
+]
+
+
+def course_bodies():
+    course = synthetic_course(1, modules=2, items=5, body_size=300, mix='uniform', sample=load_sample())
+    for item_type in ('Assignment', 'Quiz', 'Page', 'Discussion'):
+        for content in course[item_type].values():
+            yield content.get('description') or content.get('body') or content.get('message')
+
+
+def main():
+    warnings.simplefilter('ignore')
+    backends = [backend for backend in BACKENDS
+                if 'lxml' not in backend or importlib.util.find_spec('lxml') is not None]
+    differences = 0
+    cases = CASES + [body for body in course_bodies() if body]
+    for html in cases:
+        reference = extract_text(html, 'html.parser')
+        for backend in backends:
+            text = extract_text(html, backend)
+            if text != reference:
+                differences += 1
+                print(f"{backend} differs for {html[:60]!r}:\n  {text[:80]!r}\n  html.parser: {reference[:80]!r}")
+    print(f"{len(cases)} snippets, backends {', '.join(backends)}: {differences} differences")
+    return 1 if differences else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""Benchmark Course + export against a local fake Canvas
+
+Run from the backend directory:
+
+    python -m benchmarks.run                      # compare with baselines.json
+    python -m benchmarks.run --update-baseline    # record new baselines
+    python -m benchmarks.run --modules 10 --items 5 --latency 0 --scenario default
+
+Each scenario parses in a fresh process so its peak RSS is its own. A run
+fails (exit status 1) when a scenario makes more API calls than its baseline
+or is slower or bigger than the baseline by more than --tolerance.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import warnings
+
+from benchmarks.fake_canvas import FakeCanvas, load_sample, synthetic_course
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+# Course(...) options and export mode of each scenario
+SCENARIOS = {
+    'serial': {'max_workers': 1, 'prefetch': False, 'lazy': False},
+    'concurrent': {'max_workers': 8, 'prefetch': False, 'lazy': False},
+    'default': {'max_workers': 8, 'prefetch': True, 'lazy': True},
+}
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _parse_course(url, course_id, options, results):
+    """Child process body: parse and export one course, report measurements"""
+    logging.disable(logging.CRITICAL)
+    warnings.simplefilter('ignore')
+    from canvas import Course, course_to_json, write_course_json
+
+    start = time.perf_counter()
+    course = Course(course_id, url, 'benchmark-token', **options)
+    if course.lazy:
+        with open(os.devnull, 'w', encoding='utf-8') as f:
+            counts = write_course_json(course, f)
+        modules_count, total_items = counts['modules_count'], counts['total_items']
+    else:
+        course_to_json(course)
+        modules_count = len(course.modules)
+        total_items = sum(len(module.items) for module in course.modules)
+    wall_time = time.perf_counter() - start
+
+    results.put({
+        'wall_time': round(wall_time, 3),
+        'modules': modules_count,
+        'items': total_items,
+        'items_per_second': round(total_items / wall_time, 1) if wall_time else None,
+        'peak_rss_mb': round(_peak_rss_mb(), 1)
+    })
+
+
+def run_scenario(fake, course_id, options):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    fake.reset_calls()
+    process = context.Process(target=_parse_course, args=(fake.url, course_id, options, results))
+    process.start()
+    result = results.get()
+    process.join()
+    result['api_calls'] = fake.total_calls()
+    result['calls_by_endpoint'] = dict(sorted(fake.calls.items()))
+    return result
+
+
+def compare(name, result, baseline, tolerance):
+    """Return the regressions of a scenario against its baseline"""
+    problems = []
+    if result['api_calls'] > baseline['api_calls']:
+        problems.append(f"{name}: {result['api_calls']} API calls, baseline {baseline['api_calls']}")
+    for metric in ('wall_time', 'peak_rss_mb'):
+        limit = baseline[metric] * (1 + tolerance)
+        if result[metric] > limit:
+            problems.append(f"{name}: {metric} {result[metric]} exceeds baseline {baseline[metric]} "
+                            f"by more than {tolerance:.0%}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modules', type=int, default=40, help='modules in the synthetic course')
+    parser.add_argument('--items', type=int, default=15, help='items per module')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to every API response')
+    parser.add_argument('--body-size', type=int, default=2000, help='characters of HTML per content body')
+    parser.add_argument('--quota', type=float, default=None,
+                        help='meter requests against a Canvas-style rate limit of this many units')
+    parser.add_argument('--mix', choices=('sample', 'uniform'), default='sample',
+                        help='item types from the recorded export or every type in turn')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run (repeatable, default all)')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before failing')
+    parser.add_argument('--update-baseline', action='store_true', help='store these results as baselines')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args(argv)
+
+    params = {'modules': args.modules, 'items': args.items, 'latency': args.latency,
+              'body_size': args.body_size, 'mix': args.mix}
+    if args.quota is not None:
+        params['quota'] = args.quota
+    course = synthetic_course(1, modules=args.modules, items=args.items, body_size=args.body_size,
+                              mix=args.mix, sample=load_sample())
+    fake = FakeCanvas([course], latency=args.latency, quota=args.quota).start()
+    try:
+        results = {name: run_scenario(fake, 1, SCENARIOS[name])
+                   for name in (args.scenario or SCENARIOS)}
+    finally:
+        fake.stop()
+
+    if args.json:
+        print(json.dumps({'params': params, 'results': results}, indent=2))
+    else:
+        print(f"{'scenario':<12}{'wall s':>9}{'calls':>8}{'items':>8}{'items/s':>10}{'peak MB':>10}")
+        for name, result in results.items():
+            print(f"{name:<12}{result['wall_time']:>9}{result['api_calls']:>8}{result['items']:>8}"
+                  f"{result['items_per_second']:>10}{result['peak_rss_mb']:>10}")
+
+    baselines = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, 'r', encoding='utf-8') as f:
+            baselines = json.load(f)
+
+    if args.update_baseline:
+        baselines['params'] = params
+        baselines.setdefault('results', {}).update({
+            name: {key: value for key, value in result.items() if key != 'calls_by_endpoint'}
+            for name, result in results.items()
+        })
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, indent=2)
+            f.write('\n')
+        print(f"Baselines written to {BASELINE_PATH}")
+        return 0
+
+    if baselines.get('params') != params:
+        print('No baselines recorded for these parameters; skipping comparison')
+        return 0
+
+    problems = []
+    for name, result in results.items():
+        if name in baselines.get('results', {}):
+            problems.extend(compare(name, result, baselines['results'][name], args.tolerance))
+    for problem in problems:
+        print(f"REGRESSION {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""Benchmark backend cold start: import cost per module and first request
+
+Run from the backend directory:
+
+    python -m benchmarks.startup                # median of 5 fresh processes
+    python -m benchmarks.startup --runs 10 --top 20
+
+Each run starts a fresh interpreter that imports app with -X importtime and
+then sends /api/test-connection to a local fake Canvas, the way the first
+login reaches a newly started worker. --delay waits that long between the
+import and the request, like a user typing their token. Runs are made both
+the default way, with canvasapi imported in the background, and the way a
+gunicorn --preload master imports the app, with everything imported up
+front. The report lists the modules with the highest cumulative import time
+(from the preload runs, whose imports don't interleave with a background
+thread) and the median import, first request and total times of each mode.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+from benchmarks.fake_canvas import FakeCanvas, load_sample, synthetic_course
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Child process body; prints its timings as JSON on the last line of stdout
+CHILD = '''
+import json, logging, sys, time, warnings
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+logging.disable(logging.CRITICAL)
+warnings.simplefilter('ignore')
+time.sleep(float(sys.argv[2]))
+client = app.app.test_client()
+before_request = time.perf_counter()
+response = client.post('/api/test-connection', json={'api_url': sys.argv[1], 'api_key': 'benchmark-token'})
+assert response.json['success'], response.json
+done = time.perf_counter()
+print(json.dumps({'import_seconds': imported - start, 'first_request_seconds': done - before_request}))
+'''
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def run_once(url, delay, preload=False):
+    """Import app and send the first request in a fresh interpreter"""
+    env = dict(os.environ, GUNICORN_PRELOAD='true' if preload else 'false')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD, url, str(delay)],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = {'self': int(self_us), 'cumulative': int(cumulative_us), 'depth': len(indent) // 2}
+    return timings, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='modules listed by cumulative import time')
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds between import and first request')
+    args = parser.parse_args()
+
+    fake = FakeCanvas([synthetic_course(1, modules=1, items=1, sample=load_sample())]).start()
+    try:
+        modes = {
+            'background import': [run_once(fake.url, args.delay) for _ in range(args.runs)],
+            'preload': [run_once(fake.url, args.delay, preload=True) for _ in range(args.runs)],
+        }
+    finally:
+        fake.stop()
+
+    # Median per module across runs; only modules imported in every run
+    runs = modes['preload']
+    names = set.intersection(*(set(modules) for _, modules in runs))
+    medians = {
+        name: {
+            'self_ms': statistics.median(modules[name]['self'] for _, modules in runs) / 1000,
+            'cumulative_ms': statistics.median(modules[name]['cumulative'] for _, modules in runs) / 1000
+        }
+        for name in names
+    }
+
+    print(f"{'module':40} {'cumulative ms':>14} {'self ms':>9}")
+    for name, cost in sorted(medians.items(), key=lambda item: -item[1]['cumulative_ms'])[:args.top]:
+        print(f"{name:40} {cost['cumulative_ms']:14.1f} {cost['self_ms']:9.1f}")
+
+    print()
+    print(f"{'mode':20} {'import app ms':>14} {'first request ms':>17} {'total ms':>9}")
+    for mode, runs in modes.items():
+        import_ms = statistics.median(timings['import_seconds'] for timings, _ in runs) * 1000
+        request_ms = statistics.median(timings['first_request_seconds'] for timings, _ in runs) * 1000
+        print(f"{mode:20} {import_ms:14.1f} {request_ms:17.1f} {import_ms + request_ms:9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import sqlite_db
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """SQLite-backed store of raw Canvas object payloads
+
+    Entries are keyed by (namespace, key), where the namespace identifies the
+    Canvas instance, credentials and course. An entry is served while it is
+    younger than ttl seconds. With revalidate enabled, an entry older than
+    that is still served when the caller passes the object's current
+    updated_at and it matches the stored one. The least recently used
+    entries are evicted once more than max_entries are stored.
+    """
+
+    def __init__(self, path, ttl=3600, max_entries=100000, revalidate=True):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.revalidate = revalidate
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite_db.connect(path)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                updated_at TEXT,
+                stored_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)')
+        self.conn.commit()
+        sqlite_db.reopen_after_fork(self)
+
+    def get(self, namespace, key, updated_at=None):
+        """Return the cached payload dict, or None on a miss or stale entry"""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT payload, updated_at, stored_at FROM responses WHERE namespace = ? AND key = ?',
+                (namespace, key)
+            ).fetchone()
+
+            fresh = False
+            if row is not None:
+                payload, stored_updated_at, stored_at = row
+                if updated_at is not None and stored_updated_at is not None:
+                    if stored_updated_at == updated_at:
+                        fresh = self.revalidate or now - stored_at <= self.ttl
+                else:
+                    fresh = now - stored_at <= self.ttl
+
+            if not fresh:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.conn.execute(
+                'UPDATE responses SET last_used = ? WHERE namespace = ? AND key = ?',
+                (now, namespace, key)
+            )
+            self.conn.commit()
+        return json.loads(payload)
+
+    def put(self, namespace, key, payload, updated_at=None):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                (namespace, key, json.dumps(payload), updated_at, now, now)
+            )
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        count = self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+        # Evict a little more than needed so every put doesn't trigger a sweep
+        excess += max(1, self.max_entries // 20)
+        cursor = self.conn.execute(
+            'DELETE FROM responses WHERE rowid IN '
+            '(SELECT rowid FROM responses ORDER BY last_used LIMIT ?)',
+            (excess,)
+        )
+        self.evictions += cursor.rowcount
+        logger.info(f"Evicted {cursor.rowcount} cached Canvas responses")
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': entries
+            }
+
+
+def object_payload(obj):
+    """Raw JSON attributes of a canvasapi object
+
+    canvasapi adds a parsed <name>_date attribute next to every date string;
+    those are rebuilt when the object is constructed again, so they are
+    dropped along with the requester.
+    """
+    attributes = vars(obj)
+    return {
+        name: value for name, value in attributes.items()
+        if name != '_requester' and not (name.endswith('_date') and name[:-5] in attributes)
+    }
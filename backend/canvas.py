@@ -1,96 +1,795 @@
-from canvasapi import Canvas
-from bs4 import BeautifulSoup
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import importlib
 import json
 import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from cache import object_payload
+from course_state import CourseState
+from html_text import html_to_text, html_to_text_batch
+from metrics import StageTimer, instrument_session
+from scheduler import SessionView, session_for
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Largest page size Canvas honours for list endpoints
+PER_PAGE = 100
+
+# Course-wide listings used to prefetch item content, keyed by module item
+# type: (course method, listing kwargs, attribute holding the content id)
+PREFETCH_SWEEPS = {
+    'Assignment': ('get_assignments', {}, 'id'),
+    'Quiz': ('get_quizzes', {}, 'id'),
+    'Page': ('get_pages', {'include': ['body']}, 'page_id'),
+    'Discussion': ('get_discussion_topics', {}, 'id'),
+    'File': ('get_files', {}, 'id'),
+}
+
+# HTML attribute extracted to text for each content type
+CONTENT_HTML_FIELDS = {
+    'Assignment': 'description',
+    'Quiz': 'description',
+    'Page': 'body',
+    'Discussion': 'message',
+}
+
+# Lighter listings used with a revalidating cache: they return updated_at
+# without the heavy content, so only changed objects need a full fetch
+REVALIDATE_SWEEPS = {
+    'Page': ('get_pages', {}),
+}
+
+# Per-item fetch for each module item type: (course method, canvasapi module
+# and class), the class being what cached payloads are rebuilt into
+CONTENT_FETCHERS = {
+    'Assignment': ('get_assignment', 'canvasapi.assignment', 'Assignment'),
+    'Quiz': ('get_quiz', 'canvasapi.quiz', 'Quiz'),
+    'File': ('get_file', 'canvasapi.file', 'File'),
+    'Page': ('get_page', 'canvasapi.page', 'Page'),
+    'Discussion': ('get_discussion_topic', 'canvasapi.discussion_topic', 'DiscussionTopic'),
+}
+
+
+class _CanvasapiNotLoaded(Exception):
+    """Stands in for canvasapi's exceptions until load_canvasapi has run"""
+    pass
+
+
+# canvasapi is most of this module's import time, so it is imported on first
+# use rather than when the app boots. Every Canvas request starts from
+# make_canvas, which loads it, so these are the real classes by the time an
+# except clause can see one of their exceptions.
+Canvas = None
+ModuleItem = None
+RateLimitExceeded = _CanvasapiNotLoaded
+_canvasapi_lock = threading.Lock()
+
+
+def load_canvasapi():
+    """Import canvasapi, if not done yet; safe to call from any thread"""
+    global Canvas, ModuleItem, RateLimitExceeded
+    with _canvasapi_lock:
+        if Canvas is not None:
+            return
+        from canvasapi.exceptions import RateLimitExceeded as rate_limit_exceeded
+        from canvasapi.module import ModuleItem as module_item
+        for _, module_name, _ in CONTENT_FETCHERS.values():
+            importlib.import_module(module_name)
+        from canvasapi import Canvas as canvas_class
+        RateLimitExceeded = rate_limit_exceeded
+        ModuleItem = module_item
+        Canvas = canvas_class
+
+
+# Seconds between checkpoints of a crawl's finished items (see Course)
+CHECKPOINT_INTERVAL = float(os.environ.get('CANVAS_CHECKPOINT_INTERVAL', 5))
+
+# Prefetched objects a lazy course keeps in memory, those the first modules
+# need; the rest wait in a temporary file until their module is built
+PREFETCH_MAX_OBJECTS = int(os.environ.get('CANVAS_PREFETCH_MAX_OBJECTS', 1000))
+
+# Bumped when exported item fields change, so state saved by an older
+# version is not reused for items it would now export differently
+STATE_VERSION = 3
+
 
 class CourseParsingError(Exception):
     """Custom exception for course parsing errors"""
     pass
 
 
+def course_state_key(API_URL, API_KEY, course_id):
+    """Identify a course as seen through one set of credentials
+
+    Cached payloads and incremental state are only shared between parses of
+    the same course on the same Canvas instance with the same token.
+    """
+    token_hash = hashlib.sha256(API_KEY.encode('utf-8')).hexdigest()[:16]
+    return f"{API_URL}|{token_hash}|{course_id}"
+
+
+def make_canvas(API_URL, API_KEY, timer=None, shared=True):
+    """Canvas client on the credential's shared keep-alive session
+
+    Requests go through the token's scheduler, which paces them against the
+    Canvas rate limit and retries throttled ones, and are counted and timed
+    in metrics (into timer's canvas_api stage too, when given). With
+    shared=False the client keeps a session of its own, which the caller
+    closes, so credentials that may not work never get a pooled session.
+    """
+    load_canvasapi()
+    canvas = Canvas(API_URL, API_KEY)
+    requester = canvas._Canvas__requester
+    if not shared:
+        instrument_session(requester._session)
+        return canvas
+    requester._session.close()
+    requester._session = SessionView(session_for(API_URL, API_KEY), timer)
+    return canvas
+
+
+def _item_field(item, name):
+    # Module items are dicts when embedded by include[]=items, ModuleItem otherwise
+    if isinstance(item, dict):
+        return item.get(name)
+    return getattr(item, name, None)
+
+
+def failure(module, item, error):
+    """Describe a module item, or a whole module if item is None, that failed
+
+    module is None when the course's modules couldn't be listed at all.
+    """
+    return {
+        'module_id': getattr(module, 'id', None),
+        'module': getattr(module, 'name', None),
+        'item_id': _item_field(item, 'id') if item is not None else None,
+        'type': _item_field(item, 'type') if item is not None else None,
+        'title': _item_field(item, 'title') if item is not None else None,
+        'content_id': _item_field(item, 'content_id') if item is not None else None,
+        'error': str(error)
+    }
+
+
+class ParsedItem:
+    """Base of the parsed module item classes (Course.Module.Assignment etc.)
+
+    Items keep only the fields item_to_dict exports; the canvasapi object
+    they were built from is dropped as soon as the constructor returns.
+    Exported fields, with "NA" or null where a type has no value:
+
+    type          class name: Assignment, Quiz, File, Page or Discussion
+    title         name, title or display_name of the Canvas object
+    description   visible text of the description, body or message HTML
+    due_date      Assignment only
+    download_link File only (download_url), the Canvas download URL
+    file_type     File only (mime_type), the MIME type Canvas lists
+    size          File only, bytes as listed by Canvas
+    local_path    File only, path of the downloaded copy in the export archive
+    """
+    __slots__ = ('title', 'description')
+
+
+class ContentSpill:
+    """Attributes of prefetched objects in a private temporary SQLite file
+
+    The attributes are pickled with the dates canvasapi parsed, which are
+    most of the cost of building an object again. SQLite deletes the file
+    when the connection is closed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect('', check_same_thread=False)
+        self.conn.execute('PRAGMA synchronous=OFF')
+        # Each row is read back once, so a large page cache would only hold memory
+        self.conn.execute('PRAGMA cache_size=-256')
+        self.conn.execute('''
+            CREATE TABLE content (
+                item_type TEXT NOT NULL,
+                content_id TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                PRIMARY KEY (item_type, content_id)
+            )
+        ''')
+
+    def put(self, item_type, content_id, obj):
+        payload = pickle.dumps({name: value for name, value in vars(obj).items() if name != '_requester'})
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO content VALUES (?, ?, ?)', (item_type, str(content_id), payload))
+
+    def pop(self, item_type, content_id):
+        """Return the attributes stored for an object and forget them, or None"""
+        with self.lock:
+            row = self.conn.execute('SELECT payload FROM content WHERE item_type = ? AND content_id = ?',
+                                    (item_type, str(content_id))).fetchone()
+            if row is None:
+                return None
+            self.conn.execute('DELETE FROM content WHERE item_type = ? AND content_id = ?',
+                              (item_type, str(content_id)))
+        return pickle.loads(row[0])
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
 class Course:
-    def __init__(self, course_id, API_URL, API_KEY):
+    """A Canvas course parsed into modules and items
+
+    Items that fail to fetch or parse don't stop the crawl; they are left
+    out of their module and listed in failed_items with their error.
+
+    Every finished item is recorded in state, a course_state.CourseState
+    (by default a temporary file), with the fingerprint telling whether it
+    changed since. previous_state is the state of the last export; its
+    items are reused when their fingerprint is unchanged. resume_state is
+    usually the state of an attempt that died partway. Its items are
+    reused without asking Canvas whenever the module item is still listed
+    the same way, so only what the earlier attempt hadn't finished, or
+    failed on, is fetched. The state is committed at most every
+    CHECKPOINT_INTERVAL seconds as modules finish, and by save_state().
+    """
+
+    def __init__(self, course_id, API_URL, API_KEY, max_workers=1, prefetch=True, on_progress=None,
+                 cache=None, previous_state=None, lazy=False, files=None, resume_state=None, state=None):
         try:
             self.API_URL = API_URL
             self.API_KEY = API_KEY
-            self.canvas = Canvas(API_URL, API_KEY)
-            self.course = self.canvas.get_course(course_id)
+            self.max_workers = max(1, int(max_workers or 1))
+            self.prefetch = prefetch
+            # Lazy courses build nothing up front; iter_modules() crawls and
+            # yields modules one at a time without keeping them
+            self.lazy = lazy
+            self.on_progress = on_progress
+            self._progress_lock = threading.Lock()
+            self.cache = cache
+            self.cache_stats = {'hits': 0, 'misses': 0}
+            self.cache_namespace = course_state_key(API_URL, API_KEY, course_id)
+            # Items from the previous export, keyed by module item id, that are
+            # reused when their fingerprint is unchanged (see item_fingerprint)
+            if previous_state is not None and previous_state.version != STATE_VERSION:
+                previous_state = None
+            self.previous_items = previous_state.items if previous_state is not None else {}
+            if resume_state is not None and resume_state.version != STATE_VERSION:
+                resume_state = None
+            self.resumed_items = resume_state.items if resume_state is not None else {}
+            self.state = state if state is not None else CourseState()
+            self.state.start(STATE_VERSION, course_id)
+            self.state_items = self.state.items
+            # Module items (or whole modules) that couldn't be exported
+            self.failed_items = []
+            self._checkpointed_at = time.monotonic()
+            # updated_at of course content by type and id, used to tell
+            # whether cached or previously exported content is still current
+            self.validators = {}
+            # Optional files.FileDownloader that saves File items' content
+            self.files = files
+            # Per-stage timing breakdown of this parse, see metrics.StageTimer
+            self.timings = StageTimer()
+            self.canvas = make_canvas(API_URL, API_KEY, self.timings)
+            with self.timings.stage('get_course'):
+                self.course = self.canvas.get_course(course_id)
             self.course_id = course_id
             
-            # Get modules with error handling
+            # Get modules with error handling; include[]=items embeds each
+            # module's items so the whole tree comes back in one listing
             try:
-                modules = list(self.course.get_modules())
+                with self.timings.stage('list_modules'):
+                    modules = list(self.course.get_modules(include=['items'], per_page=PER_PAGE))
                 self.module_ids = [module.id for module in modules]
+            except RateLimitExceeded:
+                # Still throttled after the scheduler's retries: fail the parse
+                # rather than export a course with modules or items missing
+                raise
             except Exception as e:
                 logger.warning(f"Error getting modules for course {course_id}: {e}")
+                self.failed_items.append(failure(None, None, e))
+                modules = []
                 self.module_ids = []
+
+            self.progress = {
+                'modules_total': len(modules),
+                'modules_done': 0,
+                'items_total': sum(len(getattr(module, 'items', None) or []) for module in modules),
+                'items_done': 0,
+                'items_reused': 0,
+                'items_failed': len(self.failed_items)
+            }
+            self._advance()
             
             self.modules = []
-            for module_id in self.module_ids:
-                try:
-                    module = self.Module(self, module_id)
-                    self.modules.append(module)
-                except Exception as e:
-                    logger.warning(f"Error processing module {module_id}: {e}")
-                    continue
+            self.content_index = {}
+            self.content_spill = None
+            self.referenced_ids = {}
+            self.prefetch_order = {}
+            self._listed_modules = modules
+            if not self.lazy:
+                self.modules = list(self._crawl(window=len(modules)))
                     
         except Exception as e:
             raise CourseParsingError(f"Failed to initialize course {course_id}: {e}")
 
+    def iter_modules(self):
+        """Yield parsed modules in course order
+
+        For a lazy course each module is crawled on demand and not retained,
+        so callers can stream it out and drop it. A lazy course can only be
+        iterated once.
+        """
+        if not self.lazy:
+            yield from self.modules
+            return
+        if self._listed_modules is None:
+            raise CourseParsingError(f"Course {self.course_id} has already been iterated")
+        yield from self._crawl(window=self.max_workers)
+
+    def _crawl(self, window):
+        """Build modules in order, at most window modules ahead of the consumer"""
+        # Listed modules are dropped as they are built, with their item listings
+        modules, self._listed_modules = deque(self._listed_modules), None
+        if self.max_workers > 1:
+            # Modules and their items share one bounded pool; each module's
+            # items are queued on it and collected in listing order
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                if self.previous_items:
+                    list(executor.map(self._light_sweep, REVALIDATE_SWEEPS))
+                if self.prefetch:
+                    self.prefetch_content(modules, executor)
+                pending = deque()
+                while modules:
+                    pending.append(executor.submit(self._build_module, modules.popleft(), executor))
+                    if len(pending) >= max(window, 1):
+                        yield from self._finish_module(pending.popleft().result())
+                while pending:
+                    yield from self._finish_module(pending.popleft().result())
+        else:
+            if self.previous_items:
+                list(map(self._light_sweep, REVALIDATE_SWEEPS))
+            if self.prefetch:
+                self.prefetch_content(modules)
+            while modules:
+                yield from self._finish_module(self._build_module(modules.popleft()))
+        # Prefetched objects not handed out by now never will be
+        self.content_index = {}
+        self.prefetch_order = {}
+        if self.content_spill is not None:
+            self.content_spill.close()
+            self.content_spill = None
+        # Failures were recorded as fetches finished; list them in course order
+        order = {module_id: index for index, module_id in enumerate(self.module_ids)}
+        with self._progress_lock:
+            self.failed_items.sort(key=lambda failed: (order.get(failed['module_id'], -1), failed['item_id'] or 0))
+
+    def _finish_module(self, module):
+        if module is not None:
+            module.wait_for_items()
+            # The listing payload isn't needed once the items are built
+            module.release()
+        self._advance(modules_done=1)
+        self._checkpoint()
+        if module is not None:
+            yield module
+
+    def _checkpoint(self):
+        if time.monotonic() - self._checkpointed_at < CHECKPOINT_INTERVAL:
+            return
+        self._checkpointed_at = time.monotonic()
+        try:
+            self.save_state()
+        except Exception as e:
+            logger.warning(f"Checkpoint failed for course {self.course_id}: {e}")
+
+    def record_failure(self, module, item, error):
+        """List a module item, or a whole module when item is None, as failed"""
+        with self._progress_lock:
+            self.failed_items.append(failure(module, item, error))
+        self._advance(items_failed=1)
+
+    def _advance(self, **counts):
+        """Bump progress counters and notify on_progress with a snapshot"""
+        with self._progress_lock:
+            for key, value in counts.items():
+                self.progress[key] += value
+            snapshot = dict(self.progress)
+        if self.on_progress is not None:
+            try:
+                self.on_progress(snapshot)
+            except Exception as e:
+                logger.warning(f"Progress callback failed for course {self.course_id}: {e}")
+
+    def prefetch_content(self, modules, executor=None):
+        """Index course content by id using one paginated listing per item type
+
+        A type is only swept when modules reference more than one item of it
+        that can't be reused from the previous export or is resumed,
+        otherwise the single per-item request is cheaper than the listing. Types whose listing
+        fails are left out and fetched per item instead.
+
+        A lazy course keeps only the referenced objects, and of those only
+        the first PREFETCH_MAX_OBJECTS in course order in memory; the rest
+        go to a ContentSpill until their module is built.
+        """
+        referenced = {}
+        order = {}
+        for module in modules:
+            for item in getattr(module, 'items', None) or []:
+                # Resumed items are swept too: the sweep's updated_at decides
+                # whether they are still current (see reuse_item)
+                if str(item.get('id')) not in self.resumed_items and self.reuse_item(item) is not None:
+                    continue
+                referenced.setdefault(item.get('type'), set()).add(item.get('content_id'))
+                order.setdefault((item.get('type'), item.get('content_id')), len(order))
+        self.referenced_ids = referenced
+        if self.lazy:
+            self.prefetch_order = order
+
+        item_types = [item_type for item_type in PREFETCH_SWEEPS if len(referenced.get(item_type, ())) > 1]
+        run = executor.map if executor is not None else map
+        for item_type, index in zip(item_types, run(self._sweep_content, item_types)):
+            if index is not None:
+                self.content_index[item_type] = index
+
+    def _sweep_content(self, item_type):
+        method, kwargs, id_attr = PREFETCH_SWEEPS[item_type]
+        try:
+            if self.cache is not None and self.cache.revalidate and item_type in REVALIDATE_SWEEPS:
+                index = self._revalidate_content(item_type)
+                if index is not None:
+                    return index
+
+            validators = self.validators.setdefault(item_type, {})
+            index = {}
+            listed = 0
+            with self.timings.stage('prefetch', item_type):
+                listing = getattr(self.course, method)(per_page=PER_PAGE, **kwargs)
+                for obj in listing:
+                    content_id = getattr(obj, id_attr)
+                    listed += 1
+                    validators.setdefault(content_id, getattr(obj, 'updated_at', None))
+                    if self.cache is not None:
+                        self._cache_put(item_type, content_id, obj)
+                    if self.lazy:
+                        # canvasapi keeps every listed object unless told otherwise
+                        del listing._elements[:]
+                        if not self._keep_prefetched(item_type, content_id, obj):
+                            continue
+                    index[content_id] = obj
+            if item_type in CONTENT_HTML_FIELDS:
+                # Extract the referenced bodies in one batch; the item classes
+                # then hit the extractor's memo instead of parsing one by one
+                html_field = CONTENT_HTML_FIELDS[item_type]
+                wanted = self.referenced_ids.get(item_type, ())
+                with self.timings.stage('html_extract', item_type):
+                    html_to_text_batch(getattr(obj, html_field, None)
+                                       for content_id, obj in index.items() if content_id in wanted)
+            logger.info(f"Prefetched {listed} {item_type} objects for course {self.course_id}")
+            return index
+        except Exception as e:
+            logger.warning(f"Error prefetching {item_type} objects for course {self.course_id}: {e}")
+            return None
+
+    def _keep_prefetched(self, item_type, content_id, obj):
+        """Whether a lazy course keeps a prefetched object in memory
+
+        Objects no module item needs are dropped, and those beyond the
+        memory budget are spilled.
+        """
+        rank = self.prefetch_order.get((item_type, content_id))
+        if rank is None:
+            return False
+        if rank < PREFETCH_MAX_OBJECTS:
+            return True
+        with self._progress_lock:
+            if self.content_spill is None:
+                self.content_spill = ContentSpill()
+        self.content_spill.put(item_type, content_id, obj)
+        return False
+
+    def _light_sweep(self, item_type):
+        """Record updated_at of every object in the type's light listing
+
+        Returns {content_id: updated_at}, or None if the listing failed.
+        """
+        if item_type in self.validators:
+            return self.validators[item_type]
+        method, kwargs = REVALIDATE_SWEEPS[item_type]
+        id_attr = PREFETCH_SWEEPS[item_type][2]
+        try:
+            with self.timings.stage('revalidate', item_type):
+                listing = getattr(self.course, method)(per_page=PER_PAGE, **kwargs)
+                validators = {getattr(obj, id_attr): getattr(obj, 'updated_at', None) for obj in listing}
+        except Exception as e:
+            logger.warning(f"Error listing {item_type} objects for course {self.course_id}: {e}")
+            return None
+        self.validators[item_type] = validators
+        return validators
+
+    def _revalidate_content(self, item_type):
+        """Index cached objects still matching the light listing's updated_at
+
+        Returns None when more than one object changed, since one full sweep
+        is then cheaper than fetching each changed object on its own.
+        """
+        validators = self._light_sweep(item_type)
+        if validators is None:
+            return None
+        index = {}
+        changed = 0
+        for content_id, updated_at in validators.items():
+            cached = self._cache_get(item_type, content_id, updated_at)
+            if cached is None:
+                changed += 1
+                if changed > 1:
+                    return None
+            elif not self.lazy or self._keep_prefetched(item_type, content_id, cached):
+                index[content_id] = cached
+        logger.info(f"Revalidated {len(index)} cached {item_type} objects for course {self.course_id}")
+        return index
+
+    def fetch_content(self, item_type, content_id):
+        """Return the canvasapi object for a module item's content
+
+        Looks in the prefetch index, then the response cache, and only then
+        asks Canvas, storing what it fetched in the cache.
+        """
+        with self.timings.stage('fetch_item', item_type):
+            return self._fetch_content(item_type, content_id)
+
+    def _fetch_content(self, item_type, content_id):
+        index = self.content_index.get(item_type, {})
+        # Lazy courses hand prefetched content out once so it can be freed
+        content = index.pop(content_id, None) if self.lazy else index.get(content_id)
+        if content is not None:
+            return content
+        spill = self.content_spill
+        attributes = spill.pop(item_type, content_id) if spill is not None else None
+        if attributes is not None:
+            content = self._content_object(item_type, {})
+            vars(content).update(attributes)
+            return content
+
+        # An object the light listing shows as changed must not come from the cache
+        content = self._cache_get(item_type, content_id, self.validators.get(item_type, {}).get(content_id))
+        if content is not None:
+            return content
+
+        method = CONTENT_FETCHERS[item_type][0]
+        content = getattr(self.course, method)(content_id)
+        if self.cache is not None:
+            self._cache_put(item_type, content_id, content)
+        return content
+
+    def _cache_get(self, item_type, content_id, updated_at=None):
+        if self.cache is None:
+            return None
+        try:
+            payload = self.cache.get(self.cache_namespace, f"{item_type}:{content_id}", updated_at)
+        except Exception as e:
+            logger.warning(f"Error reading cached {item_type} {content_id}: {e}")
+            payload = None
+        with self._progress_lock:
+            self.cache_stats['hits' if payload is not None else 'misses'] += 1
+        if payload is None:
+            return None
+        return self._content_object(item_type, payload)
+
+    def _content_object(self, item_type, payload):
+        """Rebuild a canvasapi object from a stored payload"""
+        _, module_name, class_name = CONTENT_FETCHERS[item_type]
+        content_class = getattr(importlib.import_module(module_name), class_name)
+        return content_class(self.course._requester, payload)
+
+    def _cache_put(self, item_type, content_id, content):
+        try:
+            self.cache.put(self.cache_namespace, f"{item_type}:{content_id}",
+                           object_payload(content), getattr(content, 'updated_at', None))
+        except Exception as e:
+            logger.warning(f"Error caching {item_type} {content_id}: {e}")
+
+    def item_fingerprint(self, item, content=None):
+        """Metadata that changes whenever an item's exported fields may change
+
+        The last element is the content's updated_at, None when unknown.
+        """
+        item_type = _item_field(item, 'type')
+        content_id = _item_field(item, 'content_id')
+        updated_at = self.validators.get(item_type, {}).get(content_id)
+        if updated_at is None and content is not None:
+            updated_at = getattr(content, 'updated_at', None)
+        return [item_type, content_id, _item_field(item, 'title'), _item_field(item, 'position'), updated_at]
+
+    def reuse_item(self, item):
+        """Return the previously exported dict for an unchanged item, else None
+
+        Items of the resume state need the same listing fields, and the
+        same updated_at whenever this crawl knows the content's; items of
+        the previous export always need an unchanged updated_at.
+        """
+        item_id = str(_item_field(item, 'id'))
+        if item_id not in self.resumed_items and item_id not in self.previous_items:
+            return None
+        if self.files is not None and _item_field(item, 'type') == 'File':
+            # The file itself has to be downloaded again for this export
+            return None
+        fingerprint = self.item_fingerprint(item)
+        resumed = self.resumed_items.get(item_id)
+        if resumed is not None:
+            resumed_fingerprint = resumed.get('fingerprint', [])
+            if resumed_fingerprint[:-1] == fingerprint[:-1] and \
+                    (fingerprint[-1] is None or resumed_fingerprint[-1:] == fingerprint[-1:]):
+                return resumed.get('item')
+        previous = self.previous_items.get(item_id)
+        if previous is None or fingerprint[-1] is None or previous.get('fingerprint') != fingerprint:
+            return None
+        return previous.get('item')
+
+    def remember_item(self, item, content, parsed):
+        # Only the exported fields are kept, never the canvasapi objects
+        fingerprint = self.item_fingerprint(item, content)
+        if fingerprint[-1] is None and content is None:
+            # A resumed item keeps the updated_at it was fetched with
+            resumed = self.resumed_items.get(str(item.id))
+            if resumed is not None:
+                fingerprint[-1] = resumed['fingerprint'][-1]
+        with self._progress_lock:
+            self.state_items[str(item.id)] = (fingerprint, item_to_dict(parsed))
+
+    def save_state(self):
+        """Commit the items finished so far to state
+
+        Passing the state to the next Course(...) for the same course lets
+        it skip fetching and parsing items whose fingerprint hasn't
+        changed, or, as resume_state, every item that is still listed the
+        same way.
+        """
+        self.state.commit()
+
+    def _build_module(self, module, executor=None):
+        try:
+            return self.Module(self, module, executor)
+        except RateLimitExceeded:
+            raise
+        except Exception as e:
+            logger.warning(f"Error processing module {module.id}: {e}")
+            self.record_failure(module, None, e)
+            return None
+
     class Module:
-        def __init__(self, Course, module_id):
+        # Modules of a non-lazy course live as long as it does; slots keep
+        # them small and release() drops what exporting doesn't need
+        __slots__ = ('course', 'fetch_content', 'reuse_item', 'remember_item', 'record_failure', '_advance',
+                     'timings', 'files', 'module', 'course_id', 'title', 'items', 'item_ids', '_pending')
+
+        def __init__(self, Course, module, executor=None):
+            module_id = module.id
             try:
                 self.course = Course.course
-                self.module = self.course.get_module(module_id)
+                self.fetch_content = Course.fetch_content
+                self.reuse_item = Course.reuse_item
+                self.remember_item = Course.remember_item
+                self.record_failure = Course.record_failure
+                self._advance = Course._advance
+                self.timings = Course.timings
+                self.files = Course.files
+                self.module = module
                 self.course_id = self.course.id
                 self.title = self.module.name
                 self.items = []
                 
                 try:
-                    module_items = list(self.module.get_module_items())
+                    module_items = self.list_items()
                     self.item_ids = [item.id for item in module_items]
+                except RateLimitExceeded:
+                    raise
                 except Exception as e:
                     logger.warning(f"Error getting items for module {module_id}: {e}")
+                    self.record_failure(module, None, e)
+                    module_items = []
                     self.item_ids = []
                 
-                for item_id in self.item_ids:
-                    try:
-                        item = self.get_item(item_id)
-                        if item is not None:
-                            self.items.append(item)
-                    except Exception as e:
-                        logger.warning(f"Error processing item {item_id}: {e}")
-                        continue
+                # With an executor the item fetches are only queued here and
+                # collected later by wait_for_items()
+                self._pending = None
+                if executor is not None:
+                    self._pending = [(module_item, executor.submit(self._fetch_item, module_item))
+                                     for module_item in module_items]
+                else:
+                    for module_item in module_items:
+                        try:
+                            item = self._fetch_item(module_item)
+                            if item is not None:
+                                self.items.append(item)
+                        except RateLimitExceeded:
+                            raise
+                        except Exception as e:
+                            logger.warning(f"Error processing item {module_item.id}: {e}")
+                            self.record_failure(module, module_item, e)
+                            continue
                         
             except Exception as e:
                 logger.error(f"Failed to initialize module {module_id}: {e}")
                 raise
 
-        class Assignment:
-            def __init__(self, assignment_id, course):
+        def release(self):
+            """Drop the listing payload and parent references once items are built"""
+            self.module = None
+            self.course = None
+            self.fetch_content = self.reuse_item = self.remember_item = self.record_failure = self._advance = None
+            self.timings = None
+            self.files = None
+
+        def list_items(self):
+            """Return the module's items, preferring the ones embedded by include[]=items"""
+            items = getattr(self.module, 'items', None)
+            if items is None:
+                # Canvas leaves items out of the listing for very large modules
+                with self.timings.stage('list_items'):
+                    module_items = list(self.module.get_module_items(per_page=PER_PAGE))
+                self._advance(items_total=len(module_items))
+                return module_items
+            return [ModuleItem(self.module._requester, dict(item, course_id=self.course_id))
+                    for item in items]
+
+        def _fetch_item(self, module_item):
+            try:
+                return self.get_item(module_item)
+            finally:
+                self._advance(items_done=1)
+
+        def wait_for_items(self):
+            """Collect items fetched on the course worker pool in listing order
+
+            Also waits for the module's file downloads, if any were queued.
+            """
+            for module_item, future in self._pending or []:
                 try:
-                    self.course = course
-                    self.cv_assignment = self.course.get_assignment(assignment_id)
-                    self.title = self.cv_assignment.name
+                    item = future.result()
+                    if item is not None:
+                        self.items.append(item)
+                except RateLimitExceeded:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Error processing item {module_item.id}: {e}")
+                    self.record_failure(self.module, module_item, e)
+                    continue
+            self._pending = None
+            for item in self.items:
+                download = getattr(item, 'download', None)
+                if download is not None:
+                    item.local_path = download.result()
+                    item.download = None
+
+        class Assignment(ParsedItem):
+            __slots__ = ('due_date',)
+
+            def __init__(self, assignment_id, course, content=None):
+                try:
+                    cv_assignment = content if content is not None else course.get_assignment(assignment_id)
+                    self.title = cv_assignment.name
                     self.description = None
-                    if self.cv_assignment.description is not None:
+                    if cv_assignment.description is not None:
                         try:
-                            html_content = self.cv_assignment.description
-                            soup = BeautifulSoup(html_content, "html.parser")
-                            for tag in soup(["script", "style", "link"]):
-                                tag.decompose()
-                            self.description = soup.get_text(separator="\n", strip=True)
+                            html_content = cv_assignment.description
+                            self.description = html_to_text(html_content)
                         except Exception as e:
                             logger.warning(f"Error parsing assignment description: {e}")
                             self.description = "Error parsing description"
                     
                     try:
-                        self.due_date = str(self.cv_assignment.due_at_date)
+                        # A datetime, exported as ISO 8601 by item_to_dict;
+                        # unset when the assignment has no due date
+                        self.due_date = cv_assignment.due_at_date
+                    except AttributeError:
+                        self.due_date = "NA"
                     except Exception as e:
                         logger.warning(f"Error getting due date: {e}")
                         self.due_date = "NA"
@@ -99,21 +798,19 @@ class Course:
                     logger.error(f"Failed to initialize assignment {assignment_id}: {e}")
                     raise
 
-        class Quiz:
-            def __init__(self, quiz_id, course):
+        class Quiz(ParsedItem):
+            __slots__ = ()
+
+            def __init__(self, quiz_id, course, content=None):
                 try:
-                    self.course = course
-                    self.quiz = self.course.get_quiz(quiz_id)
-                    self.title = self.quiz.title
+                    quiz = content if content is not None else course.get_quiz(quiz_id)
+                    self.title = quiz.title
                     self.description = None
                     
-                    if self.quiz.description is not None:
+                    if quiz.description is not None:
                         try:
-                            html_content = self.quiz.description
-                            soup = BeautifulSoup(html_content, "html.parser")
-                            for tag in soup(["script", "style", "link"]):
-                                tag.decompose()
-                            self.description = soup.get_text(separator="\n", strip=True)
+                            html_content = quiz.description
+                            self.description = html_to_text(html_content)
                         except Exception as e:
                             logger.warning(f"Error parsing quiz description: {e}")
                             self.description = "Error parsing description"
@@ -122,46 +819,47 @@ class Course:
                     logger.error(f"Failed to initialize quiz {quiz_id}: {e}")
                     raise
 
-        class File:
-            def __init__(self, file_id, course):
+        class File(ParsedItem):
+            __slots__ = ('download_url', 'mime_type', 'size', 'local_path', 'download')
+
+            def __init__(self, file_id, course, content=None):
                 try:
-                    self.course = course
-                    self.file = self.course.get_file(file_id)
-                    self.id = file_id
-                    self.title = self.file.display_name
+                    file = content if content is not None else course.get_file(file_id)
+                    self.title = file.display_name
                     self.description = None  # Files don't typically have descriptions
                     
                     try:
-                        self.download_url = self.file.url
+                        self.download_url = file.url
                     except Exception as e:
                         logger.warning(f"Error getting file URL: {e}")
                         self.download_url = "NA"
-                        
-                    self.content = None
-                    self.processed_content = None
-                    self.metadata = {}
+                    
+                    # Canvas lists these with the file; the attribute name has a hyphen
+                    self.mime_type = getattr(file, 'content-type', None) or "NA"
+                    self.size = getattr(file, 'size', None)
+                    
+                    # File bodies are never held in memory; a FileDownloader
+                    # streams them to disk and sets local_path
+                    self.download = None
+                    self.local_path = None
                     
                 except Exception as e:
                     logger.error(f"Failed to initialize file {file_id}: {e}")
                     raise
 
-        class Page:
-            def __init__(self, page_id, course):
+        class Page(ParsedItem):
+            __slots__ = ()
+
+            def __init__(self, page_id, course, content=None):
                 try:
-                    self.course = course
-                    self.page = self.course.get_page(page_id)
-                    self.title = self.page.title
+                    page = content if content is not None else course.get_page(page_id)
+                    self.title = page.title
                     self.description = None
-                    self.body = None
                     
-                    if self.page.body is not None:
+                    if page.body is not None:
                         try:
-                            html_content = self.page.body
-                            soup = BeautifulSoup(html_content, "html.parser")
-                            for tag in soup(["script", "style", "link"]):
-                                tag.decompose()
-                            self.body = soup.get_text(separator="\n", strip=True)
-                            self.description = self.body  # Use body as description for consistency
+                            html_content = page.body
+                            self.description = html_to_text(html_content)
                         except Exception as e:
                             logger.warning(f"Error parsing page body: {e}")
                             self.description = "Error parsing page content"
@@ -170,23 +868,19 @@ class Course:
                     logger.error(f"Failed to initialize page {page_id}: {e}")
                     raise
 
-        class Discussion:
-            def __init__(self, discussion_id, course):
+        class Discussion(ParsedItem):
+            __slots__ = ()
+
+            def __init__(self, discussion_id, course, content=None):
                 try:
-                    self.course = course
-                    self.discussion = self.course.get_discussion_topic(discussion_id)
-                    self.title = self.discussion.title
+                    discussion = content if content is not None else course.get_discussion_topic(discussion_id)
+                    self.title = discussion.title
                     self.description = None
-                    self.body = None
                     
-                    if self.discussion.message is not None:
+                    if discussion.message is not None:
                         try:
-                            html_content = self.discussion.message
-                            soup = BeautifulSoup(html_content, "html.parser")
-                            for tag in soup(["script", "style", "link"]):
-                                tag.decompose()
-                            self.body = soup.get_text(separator="\n", strip=True)
-                            self.description = self.body  # Use body as description for consistency
+                            html_content = discussion.message
+                            self.description = html_to_text(html_content)
                         except Exception as e:
                             logger.warning(f"Error parsing discussion message: {e}")
                             self.description = "Error parsing discussion content"
@@ -195,112 +889,237 @@ class Course:
                     logger.error(f"Failed to initialize discussion {discussion_id}: {e}")
                     raise
 
-        def get_item(self, item_id):
+        def get_item(self, item):
             try:
-                item = self.module.get_module_item(item_id)
-                
+                # Unchanged items come back as the dict exported last time
+                stored = self.reuse_item(item)
+                if stored is not None:
+                    self._advance(items_reused=1)
+                    self.remember_item(item, None, stored)
+                    return stored
+
+                content = None
+                if item.type in CONTENT_FETCHERS:
+                    content = self.fetch_content(item.type, item.content_id)
+
+                start = time.perf_counter()
                 if item.type == 'Assignment':
-                    return self.Assignment(item.content_id, self.course)
+                    parsed = self.Assignment(item.content_id, self.course, content)
                 elif item.type == 'Quiz':
-                    return self.Quiz(item.content_id, self.course)
+                    parsed = self.Quiz(item.content_id, self.course, content)
                 elif item.type == 'File':
-                    return self.File(item.content_id, self.course)
+                    parsed = self.File(item.content_id, self.course, content)
                 elif item.type == 'Page':
-                    return self.Page(item.content_id, self.course)  # Fixed: use content_id instead of title
+                    parsed = self.Page(item.content_id, self.course, content)  # Fixed: use content_id instead of title
                 elif item.type == 'Discussion':
-                    return self.Discussion(item.content_id, self.course)
+                    parsed = self.Discussion(item.content_id, self.course, content)
                 else:
                     logger.info(f"Unsupported item type: {item.type}")
                     return None
+                if item.type in CONTENT_HTML_FIELDS:
+                    # Building the item is almost all HTML-to-text conversion
+                    self.timings.record('html_extract', time.perf_counter() - start, item.type)
+                if item.type == 'File' and self.files is not None:
+                    parsed.download = self.files.submit(self.course_id, item.content_id, parsed.title,
+                                                        parsed.download_url, parsed.mime_type, parsed.size)
+
+                self.remember_item(item, content, parsed)
+                return parsed
                     
+            except RateLimitExceeded:
+                raise
             except Exception as e:
-                logger.error(f"Error getting item {item_id}: {e}")
+                logger.error(f"Error getting item {item.id}: {e}")
+                self.record_failure(self.module, item, e)
                 return None
 
 
-def course_to_json(course_obj):
-    """Convert a Course object to JSON with error handling"""
+def item_to_dict(item):
+    """Exported fields of a parsed item; reused items already are dicts"""
+    if isinstance(item, dict):
+        return item
+
     def datetime_handler(obj):
         if hasattr(obj, 'isoformat'):
             return obj.isoformat()
         return 'NA'
 
-    try:
-        course_dict = {
-            "course_name": getattr(course_obj.course, 'name', 'Unknown Course'),
-            "course_id": course_obj.course_id,
-            "modules": []
-        }
+    item_dict = {
+        "type": item.__class__.__name__,
+        "title": getattr(item, 'title', 'NA'),
+        "description": getattr(item, 'description', 'NA'),
+        "due_date": datetime_handler(getattr(item, 'due_date', 'NA')),
+        "download_link": getattr(item, 'download_url', 'NA'),
+        "file_type": getattr(item, 'mime_type', 'NA')
+    }
+    if item_dict["type"] == 'File':
+        item_dict["size"] = getattr(item, 'size', None)
+        # Path of the downloaded copy inside the export archive, if any
+        item_dict["local_path"] = getattr(item, 'local_path', None)
+    return item_dict
+
+
+def module_to_dict(module):
+    """Exported fields of a parsed module and its items"""
+    module_dict = {
+        "title": getattr(module, 'title', 'Unknown Module'),
+        "items": []
+    }
 
-        for module in course_obj.modules:
+    for item in module.items:
+        if item is not None:  # Handle None items
             try:
-                module_dict = {
-                    "title": getattr(module, 'title', 'Unknown Module'),
-                    "items": []
-                }
+                module_dict["items"].append(item_to_dict(item))
+            except Exception as e:
+                logger.warning(f"Error serializing item: {e}")
+                continue
 
-                for item in module.items:
-                    if item is not None:  # Handle None items
-                        try:
-                            item_dict = {
-                                "type": item.__class__.__name__,
-                                "title": getattr(item, 'title', 'NA'),
-                                "description": getattr(item, 'description', 'NA'),
-                                "due_date": datetime_handler(getattr(item, 'due_date', 'NA')),
-                                "download_link": getattr(item, 'download_url', 'NA'),
-                                "file_type": getattr(item, 'mime_type', 'NA')
-                            }
-                            module_dict["items"].append(item_dict)
-                        except Exception as e:
-                            logger.warning(f"Error serializing item: {e}")
-                            continue
+    return module_dict
 
-                course_dict["modules"].append(module_dict)
-                
+
+# Output formats of iter_course_json
+EXPORT_FORMATS = ('json', 'compact', 'ndjson')
+
+
+def iter_course_json(course_obj, fmt='json', stats=None, on_module=None):
+    """Yield a course export chunk by chunk as its modules are parsed
+
+    'json' is identical to course_to_json, 'compact' is the same document
+    without whitespace and 'ndjson' writes one item per line, tagged with
+    its course and module. With a lazy Course each module is crawled, written
+    and released before the next one, so memory does not grow with the
+    course. Module and item counts are added to stats if given, and
+    on_module is called with each module's dict before its chunk is yielded.
+
+    Items that failed are listed after the modules: under "failed_items" in
+    the JSON formats, and in ndjson as lines carrying an "error" field.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise CourseParsingError(f"Unsupported export format: {fmt}")
+    if stats is None:
+        stats = {}
+    stats.setdefault('modules_count', 0)
+    stats.setdefault('total_items', 0)
+
+    course_name = getattr(course_obj.course, 'name', 'Unknown Course')
+    if fmt == 'json':
+        yield '{\n  "course_name": ' + json.dumps(course_name) + \
+              ',\n  "course_id": ' + json.dumps(course_obj.course_id) + ',\n  "modules": ['
+    elif fmt == 'compact':
+        yield '{"course_name":' + json.dumps(course_name) + \
+              ',"course_id":' + json.dumps(course_obj.course_id) + ',"modules":['
+
+    timer = getattr(course_obj, 'timings', None) or StageTimer()
+    for module in course_obj.iter_modules():
+        with timer.stage('serialize'):
+            try:
+                module_dict = module_to_dict(module)
             except Exception as e:
                 logger.warning(f"Error processing module: {e}")
                 continue
+            del module
+
+            if on_module is not None:
+                on_module(module_dict)
+            if fmt == 'ndjson':
+                lines = []
+                for item_dict in module_dict["items"]:
+                    line = {"course_name": course_name, "course_id": course_obj.course_id,
+                            "module": module_dict["title"], **item_dict}
+                    lines.append(json.dumps(line, separators=(',', ':')) + '\n')
+                chunk = ''.join(lines)
+            elif fmt == 'json':
+                # Nest the module's own indent=2 dump two levels deep
+                chunk = json.dumps(module_dict, indent=2).replace('\n', '\n    ')
+                chunk = (',' if stats['modules_count'] else '') + '\n    ' + chunk
+            else:
+                chunk = (',' if stats['modules_count'] else '') + json.dumps(module_dict, separators=(',', ':'))
+        if chunk:
+            yield chunk
+
+        stats['modules_count'] += 1
+        stats['total_items'] += len(module_dict["items"])
+
+    failed_items = getattr(course_obj, 'failed_items', [])
+    stats['failed_items'] = len(failed_items)
+    if fmt == 'json':
+        failed = json.dumps(failed_items, indent=2).replace('\n', '\n  ')
+        yield ('\n  ]' if stats['modules_count'] else ']') + ',\n  "failed_items": ' + failed + '\n}'
+    elif fmt == 'compact':
+        yield '],"failed_items":' + json.dumps(failed_items, separators=(',', ':')) + '}'
+    elif failed_items:
+        yield ''.join(json.dumps({"course_name": course_name, "course_id": course_obj.course_id, **failed},
+                                 separators=(',', ':')) + '\n' for failed in failed_items)
+
+
+def write_course_json(course_obj, fp, fmt='json', on_module=None):
+    """Stream a course export to a text file object and return its counts"""
+    stats = {}
+    timer = getattr(course_obj, 'timings', None) or StageTimer()
+    for chunk in iter_course_json(course_obj, fmt, stats, on_module):
+        with timer.stage('write'):
+            fp.write(chunk)
+    return stats
 
-        return json.dumps(course_dict, indent=2)
+
+def course_to_json(course_obj):
+    """Convert a Course object to JSON with error handling"""
+
+    try:
+        return ''.join(iter_course_json(course_obj))
         
     except Exception as e:
         logger.error(f"Error converting course to JSON: {e}")
         raise CourseParsingError(f"Failed to convert course to JSON: {e}")
 
 
-def get_courses_list(API_URL, API_KEY):
-    """Get list of courses for the authenticated user"""
+def iter_courses(API_URL, API_KEY, per_page=100):
+    """Yield the user's courses as Canvas returns them, one page at a time"""
     try:
-        canvas = Canvas(API_URL, API_KEY)
-        courses = list(canvas.get_courses())
-        
-        courses_data = []
-        for course in courses:
-            try:
-                course_info = {
-                    "id": course.id,
-                    "name": course.name,
-                    "code": getattr(course, 'course_code', 'N/A'),
-                    "workflow_state": getattr(course, 'workflow_state', 'unknown')
-                }
-                courses_data.append(course_info)
-            except Exception as e:
-                logger.warning(f"Error processing course: {e}")
-                continue
-                
-        return courses_data
-        
+        canvas = make_canvas(API_URL, API_KEY)
+        courses = canvas.get_courses(per_page=per_page)
     except Exception as e:
         logger.error(f"Error getting courses list: {e}")
         raise CourseParsingError(f"Failed to get courses: {e}")
+    
+    iterator = iter(courses)
+    while True:
+        try:
+            course = next(iterator)
+        except StopIteration:
+            return
+        except Exception as e:
+            logger.error(f"Error getting courses list: {e}")
+            raise CourseParsingError(f"Failed to get courses: {e}")
+        
+        try:
+            yield {
+                "id": course.id,
+                "name": course.name,
+                "code": getattr(course, 'course_code', 'N/A'),
+                "workflow_state": getattr(course, 'workflow_state', 'unknown')
+            }
+        except Exception as e:
+            logger.warning(f"Error processing course: {e}")
+            continue
+
+
+def get_courses_list(API_URL, API_KEY):
+    """Get list of courses for the authenticated user"""
+    return list(iter_courses(API_URL, API_KEY))
 
 
 def test_canvas_connection(API_URL, API_KEY):
     """Test Canvas API connection"""
+    canvas = None
     try:
-        canvas = Canvas(API_URL, API_KEY)
+        # Not on the shared session: only credentials that work get one
+        canvas = make_canvas(API_URL, API_KEY, shared=False)
         # Try to get user info to test connection
         user = canvas.get_current_user()
         return True, f"Connected as {user.name}"
     except Exception as e:
-        return False, f"Connection failed: {e}"
\ No newline at end of file
+        return False, f"Connection failed: {e}"
+    finally:
+        if canvas is not None:
+            canvas._Canvas__requester._session.close()
\ No newline at end of file
@@ -0,0 +1,169 @@
+import json
+import logging
+import sqlite3
+import threading
+import uuid
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Rows copied per statement when one state is merged into another
+MERGE_BATCH_SIZE = 1000
+
+
+class StateItems:
+    """Dict-style view of a CourseState's items, keyed by module item id
+
+    Values read back as {'fingerprint': [...], 'item': {...}}, the shape
+    Course looks items up in; they are set as (fingerprint, item) pairs.
+    """
+
+    def __init__(self, state):
+        self.state = state
+
+    def get(self, item_id, default=None):
+        with self.state.lock:
+            row = self.state.conn.execute('SELECT fingerprint, item FROM items WHERE item_id = ?',
+                                          (item_id,)).fetchone()
+        if row is None:
+            return default
+        return {'fingerprint': json.loads(row[0]), 'item': json.loads(row[1])}
+
+    def __contains__(self, item_id):
+        with self.state.lock:
+            row = self.state.conn.execute('SELECT 1 FROM items WHERE item_id = ?', (item_id,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self.state.lock:
+            return self.state.conn.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+
+    def __setitem__(self, item_id, value):
+        fingerprint, item = value
+        with self.state.lock:
+            self.state.conn.execute('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?)',
+                                    (item_id, json.dumps(fingerprint), json.dumps(item), self.state.run))
+
+
+class CourseState:
+    """Fingerprints and exported fields of a course's items, in an SQLite file
+
+    Course looks up the items of the previous export, or of an attempt
+    that died partway, in one of these and records the items it finishes
+    in another, so neither has to fit in memory. Writes become visible to
+    other connections when commit() is called, which Course does as its
+    checkpoints. The default path '' is a private temporary file that is
+    deleted when the state is closed.
+
+    An exclusive state holds a lock on its file until it is closed, so
+    claim() can tell the file of a running parse from one left behind by
+    a parse that died.
+    """
+
+    def __init__(self, path='', exclusive=False, conn=None):
+        self.path = path
+        self.lock = threading.Lock()
+        # Tags the rows written through this connection, see prune()
+        self.run = uuid.uuid4().hex
+        self.items = StateItems(self)
+        if conn is not None:
+            self.conn = conn
+            return
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        if exclusive:
+            self.conn.execute('PRAGMA locking_mode=EXCLUSIVE')
+        self._create_tables()
+
+    @classmethod
+    def open(cls, path):
+        """Open a saved state for reading; None if it is missing or unreadable"""
+        try:
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30, check_same_thread=False)
+            conn.execute('SELECT COUNT(*) FROM items').fetchone()
+        except sqlite3.Error as e:
+            if 'unable to open' not in str(e):
+                logger.warning(f"Ignoring unreadable course state {path}: {e}")
+            return None
+        return cls(path, conn=conn)
+
+    @classmethod
+    def claim(cls, path):
+        """Open the state file of a parse that is no longer running
+
+        Returns None when the file is still held by its parse, or can't be
+        read. The claimed state keeps the file locked until it is closed.
+        """
+        conn = sqlite3.connect(path, timeout=0, check_same_thread=False, isolation_level=None)
+        try:
+            conn.execute('PRAGMA locking_mode=EXCLUSIVE')
+            conn.execute('BEGIN EXCLUSIVE')
+            conn.execute('SELECT COUNT(*) FROM items').fetchone()
+            conn.execute('COMMIT')
+        except sqlite3.OperationalError as e:
+            conn.close()
+            if 'locked' not in str(e):
+                logger.warning(f"Ignoring unreadable course state {path}: {e}")
+            return None
+        except sqlite3.Error as e:
+            conn.close()
+            logger.warning(f"Ignoring unreadable course state {path}: {e}")
+            return None
+        return cls(path, conn=conn)
+
+    def _create_tables(self):
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS items (
+                item_id TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                item TEXT NOT NULL,
+                run TEXT
+            )
+        ''')
+        # Writing takes the lock of an exclusive state right away
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('run', ?)", (self.run,))
+        self.conn.commit()
+
+    def _meta(self, key):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    @property
+    def version(self):
+        with self.lock:
+            return self._meta('version')
+
+    def start(self, version, course_id):
+        """Record what the state is of; items of another state version are dropped"""
+        with self.lock:
+            if self._meta('version') != version:
+                self.conn.execute('DELETE FROM items')
+            self.conn.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                                  [('version', json.dumps(version)), ('course_id', json.dumps(course_id))])
+
+    def merge(self, other):
+        """Copy in the items of another state, keeping items already here"""
+        with other.lock:
+            rows = other.conn.execute('SELECT item_id, fingerprint, item FROM items')
+            with self.lock:
+                while True:
+                    batch = rows.fetchmany(MERGE_BATCH_SIZE)
+                    if not batch:
+                        break
+                    self.conn.executemany('INSERT OR IGNORE INTO items VALUES (?, ?, ?, NULL)', batch)
+
+    def prune(self):
+        """Drop items this connection didn't write, such as items merged in
+        from an earlier attempt that are no longer listed"""
+        with self.lock:
+            self.conn.execute('DELETE FROM items WHERE run IS NOT ?', (self.run,))
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
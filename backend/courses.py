@@ -0,0 +1,191 @@
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from canvas import CourseParsingError, iter_courses
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Seconds a loaded course list is served before it is reloaded in the background
+REFRESH_SECONDS = int(os.environ.get('COURSE_INDEX_REFRESH', 300))
+
+# Course lists kept in memory: the least recently used beyond
+# COURSE_INDEX_CACHE_SIZE are dropped, as are lists nobody asked for in
+# COURSE_INDEX_IDLE_TIMEOUT seconds; the shared store still has them
+CACHE_SIZE = int(os.environ.get('COURSE_INDEX_CACHE_SIZE', 256))
+IDLE_TIMEOUT = int(os.environ.get('COURSE_INDEX_IDLE_TIMEOUT', 3600))
+
+# Longest a request waits for the courses of its page to arrive from Canvas
+PAGE_TIMEOUT = 30
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+def course_matches(course, search=None, states=None):
+    """Whether a course passes the search text and workflow state filters"""
+    if states and course['workflow_state'] not in states:
+        return False
+    if search:
+        search = search.lower()
+        return search in str(course['name']).lower() or search in str(course['code']).lower()
+    return True
+
+
+class CourseIndex:
+    """One load of a user's course list, readable while it is still loading
+
+    A background thread walks Canvas's course pages and appends each course
+    as it arrives, so queries for early pages answer before the last
+    Canvas page is in.
+    """
+
+    def __init__(self, courses=None, loaded_at=None):
+        self.courses = list(courses) if courses is not None else []
+        self.complete = courses is not None
+        self.loaded_at = loaded_at if loaded_at is not None else time.time()
+        self.error = None
+        self.condition = threading.Condition()
+
+    def load(self, api_url, api_key, on_complete=None):
+        thread = threading.Thread(target=self._load, args=(api_url, api_key, on_complete),
+                                  name='course-index', daemon=True)
+        thread.start()
+
+    def _load(self, api_url, api_key, on_complete):
+        try:
+            for course in iter_courses(api_url, api_key):
+                with self.condition:
+                    self.courses.append(course)
+                    self.condition.notify_all()
+        except Exception as e:
+            logger.error(f"Error loading course list: {e}")
+            with self.condition:
+                self.error = e
+                self.condition.notify_all()
+            if on_complete is not None:
+                on_complete(self)
+            return
+        with self.condition:
+            self.complete = True
+            self.loaded_at = time.time()
+            self.condition.notify_all()
+        if on_complete is not None:
+            on_complete(self)
+
+    def query(self, offset, limit, search=None, states=None, timeout=PAGE_TIMEOUT):
+        """Return (courses, total, has_more) for one page of the filtered list
+
+        Waits until the page is filled, the list is complete or timeout
+        passes. total is None while the list is still loading.
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                matches = [course for course in self.courses if course_matches(course, search, states)]
+                # One course past the page tells whether there is another page
+                if self.complete or self.error is not None or len(matches) > offset + limit:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            if self.error is not None and not matches:
+                raise CourseParsingError(f"Failed to get courses: {self.error}")
+            total = len(matches) if self.complete else None
+            return matches[offset:offset + limit], total, len(matches) > offset + limit or not self.complete
+
+
+class CourseIndexes:
+    """Course lists per credential, reloaded in the background when stale
+
+    Finished lists are also saved to the shared store (a Namespace), so
+    other workers start from them instead of walking Canvas again. Lists
+    in memory are kept least recently used first and bounded by
+    cache_size and idle_timeout.
+    """
+
+    def __init__(self, store, refresh_seconds=REFRESH_SECONDS, cache_size=CACHE_SIZE, idle_timeout=IDLE_TIMEOUT):
+        self.store = store
+        self.refresh_seconds = refresh_seconds
+        self.cache_size = cache_size
+        self.idle_timeout = idle_timeout
+        self.indexes = OrderedDict()
+        self.used_at = {}
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(api_url, api_key):
+        return hashlib.sha256(f"{api_url}|{api_key}".encode('utf-8')).hexdigest()
+
+    def get(self, api_url, api_key):
+        """Return the credential's index, starting a load or refresh if needed"""
+        key = self.key(api_url, api_key)
+        with self.lock:
+            self._evict(adding=key not in self.indexes)
+            self.used_at[key] = time.monotonic()
+            index = self.indexes.get(key)
+            if index is not None:
+                self.indexes.move_to_end(key)
+            if index is None:
+                saved = self.store.get(key)
+                if saved is not None:
+                    index = self.indexes[key] = CourseIndex(saved['courses'], saved['loaded_at'])
+            if index is None:
+                index = self.indexes[key] = CourseIndex()
+                index.load(api_url, api_key, lambda loaded: self._loaded(key, loaded))
+                return index
+            if index.complete and time.time() - index.loaded_at > self.refresh_seconds \
+                    and key not in self.refreshing:
+                # Keep serving the stale list until the new one is complete
+                self.refreshing.add(key)
+                CourseIndex().load(api_url, api_key, lambda loaded: self._loaded(key, loaded))
+            return index
+
+    def drop(self, api_url, api_key):
+        """Forget the credential's list, in memory and in the shared store"""
+        key = self.key(api_url, api_key)
+        with self.lock:
+            self._forget(key)
+        try:
+            del self.store[key]
+        except Exception as e:
+            logger.warning(f"Error removing course list: {e}")
+
+    def _forget(self, key):
+        self.indexes.pop(key, None)
+        self.used_at.pop(key, None)
+        self.refreshing.discard(key)
+
+    def _evict(self, adding=False):
+        # Called with the lock held; indexes are in order of last use
+        now = time.monotonic()
+        limit = self.cache_size - 1 if adding else self.cache_size
+        while self.indexes:
+            key = next(iter(self.indexes))
+            if len(self.indexes) <= limit and now - self.used_at[key] <= self.idle_timeout:
+                break
+            self._forget(key)
+
+    def _loaded(self, key, index):
+        with self.lock:
+            self.refreshing.discard(key)
+            if key not in self.indexes:
+                # Evicted or dropped while loading
+                return
+            if index.error is not None:
+                # Drop a failed first load so the next request retries it
+                if self.indexes.get(key) is index:
+                    del self.indexes[key]
+                return
+            self.indexes[key] = index
+        try:
+            self.store.set(key, {'courses': index.courses, 'loaded_at': index.loaded_at})
+        except Exception as e:
+            logger.warning(f"Error saving course list: {e}")
@@ -0,0 +1,236 @@
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import sqlite_db
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Exports with these extensions get pre-compressed variants; zip archives
+# are compressed already
+COMPRESSIBLE_EXTENSIONS = ('.json', '.ndjson')
+
+# Smaller exports aren't worth a variant
+MIN_COMPRESS_BYTES = 1024
+
+# Content-Encoding of each pre-compressed variant, by file suffix
+VARIANT_ENCODINGS = {'.br': 'br', '.gz': 'gzip'}
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _compress_gzip(source, target):
+    with open(source, 'rb') as src, gzip.GzipFile(target, 'wb', compresslevel=6, mtime=0) as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+
+def _compress_brotli(source, target):
+    compressor = brotli.Compressor(quality=5)
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+            dst.write(compressor.process(chunk))
+        dst.write(compressor.finish())
+
+
+class ExportStore:
+    """Content-addressed store of export files
+
+    Each export is stored once under the SHA-256 of its bytes, so identical
+    re-exports share a blob. Every stored export also gets a download id of
+    its own, never reused or pointed elsewhere, that maps to its blob and
+    the file name it is downloaded as. JSON exports also get gzip (and, with the brotli package, br)
+    variants built when they are stored. Once blobs and their variants
+    exceed max_bytes, the least recently downloaded or stored blobs are
+    evicted along with the names pointing at them.
+    """
+
+    def __init__(self, directory, max_bytes=2 * 1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self.deduplicated = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, 'exports.sqlite3')
+        self.conn = sqlite_db.connect(self.path)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                extension TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                stored_bytes INTEGER NOT NULL,
+                variants TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        ''')
+        # Older stores mapped bare file names to blobs; names repeated across
+        # courses and exports, so those mappings can't be trusted
+        self.conn.execute('DROP TABLE IF EXISTS names')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS downloads (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS downloads_hash ON downloads (hash)')
+        self.conn.commit()
+        sqlite_db.reopen_after_fork(self)
+
+    def blob_path(self, content_hash, extension, suffix=''):
+        return os.path.join(self.directory, content_hash + extension + suffix)
+
+    def add(self, path, filename):
+        """Move the file at path into the store, downloadable as filename
+
+        Returns (content_hash, download_id, deduplicated); a deduplicated
+        file matched a stored blob and was discarded. download_id is new
+        for every call, so it names exactly this export.
+        """
+        content_hash = file_sha256(path)
+        extension = os.path.splitext(filename)[1]
+        download_id = uuid.uuid4().hex
+        now = time.time()
+
+        with self.lock:
+            row = self.conn.execute('SELECT extension FROM blobs WHERE hash = ?', (content_hash,)).fetchone()
+        if row is not None and os.path.exists(self.blob_path(content_hash, row[0])):
+            os.remove(path)
+            with self.lock:
+                self.conn.execute('UPDATE blobs SET last_used = ? WHERE hash = ?', (now, content_hash))
+                self.conn.execute('INSERT INTO downloads VALUES (?, ?, ?, ?)',
+                                  (download_id, filename, content_hash, now))
+                self.conn.commit()
+                self.deduplicated += 1
+            return content_hash, download_id, True
+
+        size = os.path.getsize(path)
+        target = self.blob_path(content_hash, extension)
+        os.replace(path, target)
+        variants = self._build_variants(target, size) if extension in COMPRESSIBLE_EXTENSIONS else []
+        stored_bytes = size + sum(os.path.getsize(target + suffix) for suffix in variants)
+
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (content_hash, extension, size, stored_bytes, ','.join(variants), now, now)
+            )
+            self.conn.execute('INSERT INTO downloads VALUES (?, ?, ?, ?)',
+                              (download_id, filename, content_hash, now))
+            self._evict(keep=content_hash)
+            self.conn.commit()
+        return content_hash, download_id, False
+
+    def _build_variants(self, target, size):
+        if size < MIN_COMPRESS_BYTES:
+            return []
+        compressors = [('.gz', _compress_gzip)]
+        if brotli is not None:
+            compressors.insert(0, ('.br', _compress_brotli))
+        variants = []
+        for suffix, compress in compressors:
+            tmp_path = f"{target}{suffix}.{uuid.uuid4().hex}.tmp"
+            try:
+                compress(target, tmp_path)
+                # Keep a variant only if it saves a meaningful amount
+                if os.path.getsize(tmp_path) < size * 0.9:
+                    os.replace(tmp_path, target + suffix)
+                    variants.append(suffix)
+            except Exception as e:
+                logger.warning(f"Error compressing {target} to {suffix}: {e}")
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return variants
+
+    def _evict(self, keep):
+        total = self.conn.execute('SELECT COALESCE(SUM(stored_bytes), 0) FROM blobs').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.conn.execute(
+            'SELECT hash, extension, stored_bytes, variants FROM blobs WHERE hash != ? ORDER BY last_used',
+            (keep,)
+        ).fetchall()
+        for content_hash, extension, stored_bytes, variants in rows:
+            if total <= self.max_bytes:
+                break
+            for suffix in [''] + [v for v in variants.split(',') if v]:
+                try:
+                    os.remove(self.blob_path(content_hash, extension, suffix))
+                except FileNotFoundError:
+                    pass
+            self.conn.execute('DELETE FROM blobs WHERE hash = ?', (content_hash,))
+            self.conn.execute('DELETE FROM downloads WHERE hash = ?', (content_hash,))
+            total -= stored_bytes
+            self.evictions += 1
+            logger.info(f"Evicted stored export {content_hash}")
+
+    def open(self, download_id, encodings=()):
+        """Look up a download id
+
+        Returns None for unknown ids, else a dict with the blob's hash, the
+        file name to download it as, the path to serve and its
+        Content-Encoding (None for the plain blob). encodings lists the
+        encodings the client accepts, most preferred first; the first one
+        with a stored variant is used.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT blobs.hash, blobs.extension, blobs.variants, downloads.filename FROM downloads '
+                'JOIN blobs ON blobs.hash = downloads.hash WHERE downloads.id = ?',
+                (download_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            content_hash, extension, variants, filename = row
+            self.conn.execute('UPDATE blobs SET last_used = ? WHERE hash = ?', (time.time(), content_hash))
+            self.conn.commit()
+
+        available = {VARIANT_ENCODINGS[suffix]: suffix for suffix in variants.split(',') if suffix}
+        for encoding in encodings:
+            suffix = available.get(encoding)
+            if suffix is not None and os.path.exists(self.blob_path(content_hash, extension, suffix)):
+                return {'hash': content_hash, 'filename': filename,
+                        'path': self.blob_path(content_hash, extension, suffix), 'encoding': encoding}
+        path = self.blob_path(content_hash, extension)
+        if not os.path.exists(path):
+            return None
+        return {'hash': content_hash, 'filename': filename, 'path': path, 'encoding': None}
+
+    def stats(self):
+        with self.lock:
+            blobs, stored_bytes = self.conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(stored_bytes), 0) FROM blobs').fetchone()
+            downloads = self.conn.execute('SELECT COUNT(*) FROM downloads').fetchone()[0]
+            return {
+                'blobs': blobs,
+                'downloads': downloads,
+                'stored_bytes': stored_bytes,
+                'max_bytes': self.max_bytes,
+                'deduplicated': self.deduplicated,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,165 @@
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+from metrics import instrument_session
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Files downloaded at the same time per parse
+DOWNLOAD_WORKERS = int(os.environ.get('FILE_DOWNLOAD_WORKERS', 4))
+
+# Total bytes a parse may download (0 for no limit) and the largest single file
+MAX_BYTES = int(os.environ.get('FILE_DOWNLOAD_MAX_BYTES', 1024 ** 3))
+MAX_FILE_BYTES = int(os.environ.get('FILE_DOWNLOAD_MAX_FILE_BYTES', 0))
+
+# Bytes read from the response and written to disk at a time
+CHUNK_SIZE = 1024 * 1024
+
+# Seconds to wait for a connection or the next chunk
+TIMEOUT = 60
+
+
+def safe_filename(name):
+    """Reduce a Canvas display name to something safe to use as a file name"""
+    name = re.sub(r'[^\w.\- ]', '_', name or '').strip(' .')
+    return name[:150] or 'file'
+
+
+class FileBudgetExceeded(Exception):
+    """A download would go over the per-file or per-parse byte limit"""
+    pass
+
+
+class FileDownloader:
+    """Download a parse's files concurrently, streaming each one to disk
+
+    Files are written under directory/<course_id>/ in CHUNK_SIZE pieces, so
+    memory use doesn't depend on file size. types is a list of MIME type
+    patterns ('application/pdf', 'image/*') a file must match to be fetched.
+    max_bytes caps the bytes of the whole parse and max_file_bytes those of
+    one file; files over either are skipped, using the listed size up front
+    and the bytes actually received while streaming. 0 or None is no limit.
+    """
+
+    def __init__(self, directory, types=None, max_bytes=MAX_BYTES, max_file_bytes=MAX_FILE_BYTES,
+                 workers=DOWNLOAD_WORKERS, api_key=None, timer=None):
+        self.directory = directory
+        self.types = list(types) if types else None
+        self.max_bytes = max_bytes or None
+        self.max_file_bytes = max_file_bytes or None
+        self.timer = timer
+        self.reserved = 0
+        self.stats = {'downloaded': 0, 'skipped': 0, 'failed': 0, 'bytes': 0}
+        self.lock = threading.Lock()
+
+        # requests is imported here, on first use, to keep it out of app startup
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(1, workers))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        if api_key:
+            # requests drops this header when Canvas redirects to its file store
+            self.session.headers['Authorization'] = f'Bearer {api_key}'
+        instrument_session(self.session)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='file-download')
+
+    def wanted(self, mime_type):
+        if self.types is None:
+            return True
+        return any(fnmatch(mime_type or '', pattern) for pattern in self.types)
+
+    def _count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def _reserve(self, size):
+        """Claim size bytes of the parse budget; False if it doesn't fit"""
+        with self.lock:
+            if self.max_bytes is not None and self.reserved + size > self.max_bytes:
+                return False
+            self.reserved += size
+            return True
+
+    def _release(self, size):
+        with self.lock:
+            self.reserved -= size
+
+    def submit(self, course_id, file_id, display_name, url, mime_type=None, size=None):
+        """Queue a file download
+
+        Returns a future of the path of the saved file relative to the
+        export ('files/<course_id>/<file_id>_<name>'), or None when the file
+        is filtered out or over budget (the future then resolves to None).
+        """
+        if not url or url == 'NA' or not self.wanted(mime_type):
+            self._count('skipped')
+            return None
+        if size is not None and self.max_file_bytes is not None and size > self.max_file_bytes:
+            logger.info(f"Skipping file {file_id}: {size} bytes is over the per-file limit")
+            self._count('skipped')
+            return None
+        if size is not None and not self._reserve(size):
+            logger.info(f"Skipping file {file_id}: download budget of {self.max_bytes} bytes used up")
+            self._count('skipped')
+            return None
+        return self.executor.submit(self._download, course_id, file_id, display_name, url, size or 0)
+
+    def _download(self, course_id, file_id, display_name, url, reserved):
+        name = f"{file_id}_{safe_filename(display_name)}"
+        course_dir = os.path.join(self.directory, str(course_id))
+        os.makedirs(course_dir, exist_ok=True)
+        path = os.path.join(course_dir, name)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        received = 0
+        start = time.perf_counter()
+        try:
+            with self.session.get(url, stream=True, timeout=TIMEOUT) as response:
+                response.raise_for_status()
+                with open(tmp_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        received += len(chunk)
+                        if self.max_file_bytes is not None and received > self.max_file_bytes:
+                            raise FileBudgetExceeded(f"over the per-file limit of {self.max_file_bytes} bytes")
+                        if received > reserved:
+                            # Bigger than listed (or size unknown): claim the rest as it arrives
+                            if not self._reserve(received - reserved):
+                                raise FileBudgetExceeded(f"download budget of {self.max_bytes} bytes used up")
+                            reserved = received
+                        f.write(chunk)
+            os.replace(tmp_path, path)
+        except FileBudgetExceeded as e:
+            logger.info(f"Skipping file {file_id}: {e}")
+            self._release(reserved)
+            self._count('skipped')
+            return None
+        except Exception as e:
+            logger.warning(f"Error downloading file {file_id}: {e}")
+            self._release(reserved)
+            self._count('failed')
+            return None
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if self.timer is not None:
+                self.timer.record('download', time.perf_counter() - start)
+
+        # Hand back what the file didn't use of its listed size
+        self._release(reserved - received)
+        self._count('downloaded')
+        self._count('bytes', received)
+        return f"files/{course_id}/{name}"
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
@@ -0,0 +1,9 @@
+import os
+
+# Gunicorn reads this file from the directory it starts in (backend/).
+# GUNICORN_PRELOAD=true imports the app once in the master process and forks
+# the workers from it, so they boot without repeating the imports and share
+# the imported code's memory. app.py reads the same variable to import
+# canvasapi up front, and its SQLite connections and Canvas sessions are
+# reopened in each worker after the fork.
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'false').lower() == 'true'
@@ -0,0 +1,202 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Tags whose content never ends up in the extracted text
+STRIPPED_TAGS = ("script", "style", "link")
+
+# Extraction backends, fastest first: lxml walks the parsed tree directly,
+# bs4-lxml builds a BeautifulSoup tree with the lxml parser, and html.parser
+# is the pure-Python fallback. All produce the same text for Canvas HTML;
+# python -m benchmarks.html_parity checks that they still do.
+BACKENDS = ('lxml', 'bs4-lxml', 'html.parser')
+
+# Number of extracted texts kept in the content-hash memo
+MEMO_SIZE = int(os.environ.get('HTML_MEMO_SIZE', 4096))
+
+# Batches smaller than this many characters are not worth a process pool
+BATCH_POOL_MIN_CHARS = 512 * 1024
+
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def _default_backend():
+    backend = os.environ.get('HTML_BACKEND')
+    if backend in BACKENDS:
+        return backend
+    try:
+        import lxml.html  # noqa: F401
+        return 'lxml'
+    except ImportError:
+        return 'html.parser'
+
+
+default_backend = _default_backend()
+
+
+def _lxml_texts(root):
+    """Text nodes of root in document order, skipping STRIPPED_TAGS
+
+    Like bs4's get_text, the tail after a skipped element (or comment) stays
+    a text node of its own rather than being merged into its neighbours.
+    """
+    texts = [root.text] if root.text else []
+    # Children iterators of the open elements, each with the element whose
+    # tail follows once its children are done
+    stack = [(iter(root), None)]
+    while stack:
+        children, parent = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            if parent is not None and parent.tail:
+                texts.append(parent.tail)
+            continue
+        # Comments and processing instructions have a callable tag
+        if isinstance(child.tag, str) and child.tag.lower() not in STRIPPED_TAGS:
+            if child.text:
+                texts.append(child.text)
+            stack.append((iter(child), child))
+        elif child.tail:
+            texts.append(child.tail)
+    return texts
+
+
+def _extract_lxml(html):
+    from lxml import etree
+    from lxml.html import document_fromstring
+
+    try:
+        root = document_fromstring(html)
+    except etree.ParserError:
+        # Raised for input with no elements or text, e.g. only a comment
+        return ""
+    except ValueError:
+        # lxml refuses str input with an XML encoding declaration
+        return _extract_bs4(html, "lxml")
+    return "\n".join(text.strip() for text in _lxml_texts(root) if text.strip())
+
+
+def _extract_bs4(html, parser):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, parser)
+    for tag in soup(list(STRIPPED_TAGS)):
+        tag.decompose()
+    return soup.get_text(separator="\n", strip=True)
+
+
+def extract_text(html, backend=None):
+    """Extract visible text from HTML without memoization
+
+    Text nodes are stripped and joined with newlines, skipping empty ones.
+    """
+    backend = backend or default_backend
+    if not html or not html.strip():
+        return ""
+    if backend == 'lxml':
+        return _extract_lxml(html)
+    if backend == 'bs4-lxml':
+        return _extract_bs4(html, "lxml")
+    if backend == 'html.parser':
+        return _extract_bs4(html, "html.parser")
+    raise ValueError(f"Unknown HTML backend: {backend}")
+
+
+def _memo_key(html, backend):
+    return backend + ':' + hashlib.sha1(html.encode('utf-8')).hexdigest()
+
+
+def _memo_get(key):
+    with _memo_lock:
+        text = _memo.get(key)
+        if text is not None:
+            _memo.move_to_end(key)
+        return text
+
+
+def _memo_put(key, text):
+    with _memo_lock:
+        _memo[key] = text
+        _memo.move_to_end(key)
+        while len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+
+
+def html_to_text(html, backend=None):
+    """Extract visible text from HTML, memoized by content hash
+
+    Identical bodies (e.g. boilerplate shared across items) are parsed once.
+    """
+    backend = backend or default_backend
+    if not html or not html.strip():
+        return ""
+    key = _memo_key(html, backend)
+    text = _memo_get(key)
+    if text is None:
+        text = extract_text(html, backend)
+        _memo_put(key, text)
+    return text
+
+
+def html_to_text_batch(htmls, backend=None, processes=None):
+    """Extract text from many HTML strings, in order
+
+    Bodies not already memoized are extracted on a process pool when the
+    batch is large enough to pay for it, and the results are memoized so
+    later html_to_text calls for the same content are free.
+    """
+    backend = backend or default_backend
+    htmls = list(htmls)
+    results = [None] * len(htmls)
+    misses = {}
+    for index, html in enumerate(htmls):
+        if not html or not html.strip():
+            results[index] = ""
+            continue
+        key = _memo_key(html, backend)
+        text = _memo_get(key)
+        if text is None:
+            misses.setdefault(key, (html, []))[1].append(index)
+        else:
+            results[index] = text
+
+    if not misses:
+        return results
+
+    if processes is None:
+        # In-process by default: with lxml, pickling bodies to workers usually
+        # costs more than parsing them, so the pool is opt-in
+        processes = int(os.environ.get('HTML_PROCESSES', 1))
+    pending = list(misses.values())
+    total_chars = sum(len(html) for html, _ in pending)
+
+    texts = None
+    if processes > 1 and len(pending) > 1 and total_chars >= BATCH_POOL_MIN_CHARS:
+        try:
+            # Spawned workers: the caller is usually a crawler thread, and
+            # forking a multi-threaded process can deadlock the children
+            with ProcessPoolExecutor(max_workers=min(processes, len(pending)),
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                texts = list(executor.map(extract_text, [html for html, _ in pending],
+                                          [backend] * len(pending),
+                                          chunksize=max(1, len(pending) // (processes * 4))))
+        except Exception as e:
+            logger.warning(f"Process pool extraction failed, extracting in-process: {e}")
+    if texts is None:
+        texts = [extract_text(html, backend) for html, _ in pending]
+
+    for (key, (html, indexes)), text in zip(misses.items(), texts):
+        _memo_put(key, text)
+        for index in indexes:
+            results[index] = text
+    return results
@@ -0,0 +1,241 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import hashlib
+import logging
+import queue
+import threading
+import time
+import uuid
+
+from metrics import PARSE_DURATION, PARSE_JOBS
+from store import MemoryStore, Namespace
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Progress is written to the store at most this often per job; state
+# changes are always written
+PROGRESS_SAVE_INTERVAL = 0.5
+
+# A running job's records are rewritten this many times per heartbeat TTL,
+# so they only expire once the process running it is gone
+HEARTBEATS_PER_TTL = 3
+
+
+class Job:
+    """State of one background parse, readable while it runs"""
+
+    def __init__(self, key):
+        self.id = str(uuid.uuid4())
+        self.key = key
+        self.state = 'queued'
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = datetime.now()
+        self.finished_at = None
+        self.saved_at = 0.0
+        # Event queues of listeners in this process, and the events replayed
+        # to a listener that joins late
+        self.listeners = []
+        self.replay = []
+
+    @property
+    def finished(self):
+        return self.state in ('completed', 'failed')
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'state': self.state,
+            'progress': dict(self.progress),
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a read-only snapshot of a job saved by another process"""
+        job = cls(None)
+        job.id = data['job_id']
+        job.state = data['state']
+        job.progress = data['progress']
+        job.result = data['result']
+        job.error = data['error']
+        job.created_at = datetime.fromisoformat(data['created_at'])
+        job.finished_at = datetime.fromisoformat(data['finished_at']) if data['finished_at'] else None
+        return job
+
+
+class JobManager:
+    """Run parse jobs on a worker pool, deduplicating jobs that share a key
+
+    Job state goes to a shared store, so any process using the same store
+    can report on a job and deduplicates against jobs running elsewhere.
+    Jobs run in the process that queued them. A finished job stays
+    readable for retention_seconds. A queued or running job's records
+    expire heartbeat_seconds after they were last written and a heartbeat
+    thread keeps rewriting them, so when its process dies the job drops
+    out of the store and new submits with its key start a fresh job
+    instead of deduplicating onto a job nobody runs.
+    """
+
+    def __init__(self, max_workers=2, retention_seconds=3600, store=None, heartbeat_seconds=60):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='parse-job')
+        self.retention_seconds = retention_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        store = store if store is not None else MemoryStore()
+        self.saved = Namespace(store, 'jobs', ttl=retention_seconds)
+        self.active = Namespace(store, 'active_jobs', ttl=heartbeat_seconds)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.heartbeat = None
+
+    @staticmethod
+    def make_key(*parts):
+        """Hash the dedup key so credentials never sit in memory as job keys"""
+        return hashlib.sha256('\x00'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+    def submit(self, key, func):
+        """Queue func(job) unless a job with the same key is still running
+
+        Returns (job, created) where created is False for a deduplicated job.
+        """
+        job = Job(key)
+        with self.lock:
+            self._purge()
+        # Save the record before claiming the key, so whoever finds the key
+        # can also read the job
+        self.saved.set(job.id, job.to_dict(), ttl=self.heartbeat_seconds)
+        if not self.active.add(key, job.id):
+            running = self.get(self.active.get(key))
+            if running is not None and not running.finished:
+                del self.saved[job.id]
+                return running, False
+            # The running job's record expired with its process; take over
+            self.active[key] = job.id
+        with self.lock:
+            self.jobs[job.id] = job
+            self._save(job)
+            if self.heartbeat is None:
+                # Started on first use, so a master process that forks
+                # workers after loading the app has no thread to lose
+                self.heartbeat = threading.Thread(target=self._beat, name='parse-job-heartbeat', daemon=True)
+                self.heartbeat.start()
+
+        self.executor.submit(self._run, job, func)
+        return job, True
+
+    def get(self, job_id):
+        if job_id is None:
+            return None
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            return job
+        data = self.saved.get(job_id)
+        return None if data is None else Job.from_dict(data)
+
+    def update_progress(self, job, progress):
+        with self.lock:
+            job.progress = dict(progress)
+            if time.monotonic() - job.saved_at >= PROGRESS_SAVE_INTERVAL:
+                self._save(job)
+                self._publish(job, 'progress', dict(job.progress))
+
+    def publish(self, job, event, data, replay=False):
+        """Send an (event, data) pair to the job's listeners
+
+        With replay, listeners that start listening later get it too, so
+        keep replayed events small.
+        """
+        with self.lock:
+            if replay:
+                job.replay.append((event, data))
+            self._publish(job, event, data)
+
+    def _publish(self, job, event, data):
+        for listener in job.listeners:
+            listener.put((event, data))
+
+    def listen(self, job_id):
+        """Return a queue of the events published by a job running in this process
+
+        The queue starts with the job's replayed events and ends with None
+        once the job finished. Returns None when the job isn't running
+        here: it finished already, or another process runs it.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.finished:
+                return None
+            events = queue.Queue()
+            for event in job.replay:
+                events.put(event)
+            events.put(('progress', dict(job.progress)))
+            job.listeners.append(events)
+            return events
+
+    def stop_listening(self, job_id, events):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None and events in job.listeners:
+                job.listeners.remove(events)
+
+    def _save(self, job):
+        job.saved_at = time.monotonic()
+        if job.finished:
+            self.saved[job.id] = job.to_dict()
+        else:
+            self.saved.set(job.id, job.to_dict(), ttl=self.heartbeat_seconds)
+            self.active[job.key] = job.id
+
+    def _beat(self):
+        while True:
+            time.sleep(self.heartbeat_seconds / HEARTBEATS_PER_TTL)
+            with self.lock:
+                for job in list(self.jobs.values()):
+                    if job.finished:
+                        continue
+                    try:
+                        self._save(job)
+                    except Exception as e:
+                        logger.error(f"Error saving job {job.id}: {e}")
+
+    def _run(self, job, func):
+        with self.lock:
+            job.state = 'running'
+            self._save(job)
+        start = time.perf_counter()
+        try:
+            job.result = func(job)
+            job.state = 'completed'
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}")
+            job.error = str(e)
+            job.state = 'failed'
+        finally:
+            job.finished_at = datetime.now()
+            PARSE_JOBS.inc(state=job.state)
+            PARSE_DURATION.observe(time.perf_counter() - start, state=job.state)
+            with self.lock:
+                try:
+                    self._save(job)
+                except Exception as e:
+                    logger.error(f"Error saving job {job.id}: {e}")
+                for listener in job.listeners:
+                    listener.put(None)
+                job.listeners = []
+                job.replay = []
+                if self.active.get(job.key) == job.id:
+                    del self.active[job.key]
+
+    def _purge(self):
+        now = datetime.now()
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished and (now - job.finished_at).total_seconds() > self.retention_seconds]
+        for job_id in expired:
+            del self.jobs[job_id]
@@ -0,0 +1,227 @@
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import threading
+import time
+
+# Histogram upper bounds in seconds; the last bucket is always +Inf
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label combination"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}'
+                for key, value in values]
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label combination"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        with self.lock:
+            values = sorted((key, dict(series, buckets=list(series['buckets'])))
+                            for key, series in self.values.items())
+        lines = []
+        for key, series in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series['buckets']):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_number(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_number(series["sum"])}')
+            lines.append(f'{self.name}_count{labels} {series["count"]}')
+        return lines
+
+
+class Registry:
+    """Process-wide set of metrics rendered in Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Prometheus text format content type served by /api/metrics
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+API_REQUESTS = REGISTRY.counter(
+    'canvas_api_requests_total', 'Canvas API requests by method, endpoint, page and status',
+    ('method', 'endpoint', 'page', 'status'))
+API_LATENCY = REGISTRY.histogram(
+    'canvas_api_request_duration_seconds', 'Canvas API request latency by endpoint',
+    ('method', 'endpoint'))
+STAGE_LATENCY = REGISTRY.histogram(
+    'parse_stage_duration_seconds', 'Time spent in each parse stage, by content type where it applies',
+    ('stage', 'type'))
+PARSE_JOBS = REGISTRY.counter(
+    'parse_jobs_total', 'Finished background parse jobs by final state', ('state',))
+PARSE_DURATION = REGISTRY.histogram(
+    'parse_job_duration_seconds', 'Wall time of background parse jobs', ('state',))
+
+
+def endpoint_pattern(url):
+    """Collapse ids in a Canvas URL path so requests group by endpoint
+
+    Canvas paths alternate collection and id (/courses/1/modules/2/items),
+    so every second segment is replaced with :id.
+    """
+    path = urlsplit(url).path
+    if path.startswith('/api/v1'):
+        path = path[len('/api/v1'):]
+    segments = [segment for segment in path.split('/') if segment]
+    return '/' + '/'.join(':id' if index % 2 else segment for index, segment in enumerate(segments))
+
+
+class StageTimer:
+    """Per-parse breakdown of where time goes
+
+    Every recorded stage also feeds the process-wide histograms. Stages run
+    on worker threads and nest (fetch_item includes its API requests), so
+    their seconds are summed across threads and overlap each other.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, item_type=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, item_type)
+
+    def record(self, name, seconds, item_type=None, observe=True):
+        if observe:
+            STAGE_LATENCY.observe(seconds, stage=name, type=item_type or '')
+        with self.lock:
+            totals = self.stages.setdefault(name, {'count': 0, 'seconds': 0.0})
+            totals['count'] += 1
+            totals['seconds'] += seconds
+            if item_type:
+                by_type = totals.setdefault('by_type', {}).setdefault(item_type, {'count': 0, 'seconds': 0.0})
+                by_type['count'] += 1
+                by_type['seconds'] += seconds
+
+    def breakdown(self):
+        """Counts and seconds per stage, rounded to milliseconds"""
+        def rounded(totals):
+            result = {'count': totals['count'], 'seconds': round(totals['seconds'], 3)}
+            if 'by_type' in totals:
+                result['by_type'] = {item_type: rounded(value) for item_type, value in totals['by_type'].items()}
+            return result
+
+        with self.lock:
+            stages = {name: rounded(totals) for name, totals in self.stages.items()}
+        return {'total_seconds': round(time.perf_counter() - self.started, 3), 'stages': stages}
+
+
+def instrument_session(session):
+    """Count and time every request made through a requests session
+
+    Canvas requesters send everything, pagination included, through their
+    session, so wrapping it sees each HTTP round trip.
+    """
+    send = session.request
+
+    def request(method, url, *args, **kwargs):
+        endpoint = endpoint_pattern(url)
+        # Canvas next-page links carry a page parameter; first pages don't
+        params = kwargs.get('params')
+        query = urlsplit(url).query
+        is_next = 'page=' in query or (isinstance(params, (list, tuple)) and any(key == 'page' for key, _ in params))
+        status = 'error'
+        start = time.perf_counter()
+        try:
+            response = send(method, url, *args, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            elapsed = time.perf_counter() - start
+            API_REQUESTS.inc(method=method, endpoint=endpoint, page='next' if is_next else 'first', status=status)
+            API_LATENCY.observe(elapsed, method=method, endpoint=endpoint)
+
+    session.request = request
+    return session
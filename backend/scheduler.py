@@ -0,0 +1,321 @@
+from collections import deque
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+
+from metrics import REGISTRY, instrument_session
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Most requests in flight at once per Canvas token, across every parse
+MAX_CONCURRENCY = int(os.environ.get('CANVAS_MAX_CONCURRENCY', 16))
+
+# Throttled requests are retried this many times before the error surfaces
+MAX_RETRIES = int(os.environ.get('CANVAS_MAX_RETRIES', 6))
+
+# Canvas starts every token with 700 units of quota. Below LOW_WATER the
+# scheduler halves its concurrency; above HIGH_WATER it adds a slot back.
+LOW_WATER = 200
+HIGH_WATER = 450
+
+# Quota Canvas holds back while a request is in flight, refunded when it ends;
+# more requests than remaining / PREFLIGHT_PENALTY at once get throttled
+PREFLIGHT_PENALTY = 50
+
+# Canvas doesn't publish how fast the bucket drains; assuming a slow leak
+# means waiting a little too long rather than being throttled again
+LEAK_RATE = float(os.environ.get('CANVAS_QUOTA_LEAK_RATE', 10))
+
+# Backoff before retrying a throttled request: BASE_DELAY doubled per attempt,
+# capped at MAX_DELAY, with half of it randomized so retries don't line up
+BASE_DELAY = 0.5
+MAX_DELAY = 30.0
+
+# Concurrency is cut at most once per this many seconds, so one burst of
+# low-quota responses from requests already in flight only counts once
+DECREASE_INTERVAL = 1.0
+
+# Credentials whose session and scheduler are kept. Beyond this many the
+# least recently used idle ones are closed, as is any credential that has
+# made no request for SESSION_IDLE_TIMEOUT seconds.
+SESSION_CACHE_SIZE = int(os.environ.get('CANVAS_SESSION_CACHE_SIZE', 64))
+SESSION_IDLE_TIMEOUT = float(os.environ.get('CANVAS_SESSION_IDLE_TIMEOUT', 900))
+
+RETRIES = REGISTRY.counter(
+    'canvas_api_retries_total', 'Canvas API requests retried after being throttled', ('status',))
+THROTTLE_WAIT = REGISTRY.histogram(
+    'canvas_api_throttle_wait_seconds', 'Backoff slept before retrying a throttled Canvas request')
+
+
+def is_throttled(response):
+    """Whether Canvas refused a request for exceeding the token's quota"""
+    if response.status_code == 429:
+        return True
+    return response.status_code == 403 and b'Rate Limit Exceeded' in (response.content or b'')
+
+
+def _header_float(response, name):
+    try:
+        return float(response.headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenScheduler:
+    """Admission control for every Canvas request made with one token
+
+    Canvas meters each token with a leaky bucket and reports what is left in
+    X-Rate-Limit-Remaining (and what a request used in X-Request-Cost). The
+    scheduler caps requests in flight, halving the cap when the quota runs
+    low or a request is throttled and growing it one slot at a time while
+    the quota is healthy. Throttled requests wait out a jittered backoff,
+    during which no new request on the token starts, and are retried.
+    Waiting requests are admitted first come, first served, so parses
+    sharing a token progress at the same rate.
+    """
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, max_retries=MAX_RETRIES):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.limit = self.max_concurrency
+        self.in_flight = 0
+        self.remaining = None
+        self.remaining_at = 0.0
+        self.request_cost = None
+        self.resume_at = 0.0
+        self.last_decrease = 0.0
+        self.used_at = time.monotonic()
+        self.waiting = deque()
+        self.condition = threading.Condition()
+
+    def _estimated_remaining(self, now):
+        # The last reported quota plus what has leaked out of the bucket since
+        return self.remaining + (now - self.remaining_at) * LEAK_RATE
+
+    def _allowed(self, now):
+        if self.remaining is None:
+            return self.limit
+        # Reported quota already excludes requests that were in flight then
+        return max(1, min(self.limit, int(self._estimated_remaining(now) // PREFLIGHT_PENALTY)))
+
+    def _acquire(self):
+        ticket = object()
+        with self.condition:
+            self.waiting.append(ticket)
+            while True:
+                now = time.monotonic()
+                wait = self.resume_at - now
+                if self.waiting[0] is ticket and wait <= 0 and self.in_flight < self._allowed(now):
+                    self.waiting.popleft()
+                    self.in_flight += 1
+                    # The next waiter may fit too
+                    self.condition.notify_all()
+                    return
+                self.condition.wait(timeout=wait if wait > 0 else None)
+
+    def _release(self, response=None, throttled=False):
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            self.used_at = now
+            if response is not None:
+                remaining = _header_float(response, 'X-Rate-Limit-Remaining')
+                cost = _header_float(response, 'X-Request-Cost')
+                if remaining is not None:
+                    self.remaining = remaining
+                    self.remaining_at = now
+                if cost is not None:
+                    self.request_cost = cost
+                if remaining is not None and remaining < PREFLIGHT_PENALTY + (self.request_cost or 0):
+                    # Too little quota left for another request to be admitted:
+                    # hold every request until the bucket has drained enough
+                    refill = (PREFLIGHT_PENALTY + (self.request_cost or 0) - remaining) / LEAK_RATE
+                    self.resume_at = max(self.resume_at, now + refill)
+            if throttled or (self.remaining is not None and self.remaining < LOW_WATER):
+                if now - self.last_decrease >= DECREASE_INTERVAL:
+                    self.limit = max(1, self.limit // 2)
+                    self.last_decrease = now
+            elif self.remaining is not None and self.remaining > HIGH_WATER and self.limit < self.max_concurrency:
+                self.limit += 1
+            self.condition.notify_all()
+
+    def _backoff(self, attempt, response):
+        retry_after = _header_float(response, 'Retry-After')
+        delay = min(MAX_DELAY, BASE_DELAY * (2 ** attempt))
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        with self.condition:
+            # Wait at least as long as the quota needs to refill, if known;
+            # the resume time is shared so the whole token backs off at once
+            delay = max(delay, self.resume_at - time.monotonic())
+            self.resume_at = time.monotonic() + delay
+        return delay
+
+    def request(self, send, method, url, *args, **kwargs):
+        """Send a request through the scheduler, retrying while throttled
+
+        Returns the last response; once retries run out that is the
+        throttled one, which canvasapi raises as RateLimitExceeded.
+        """
+        attempt = 0
+        while True:
+            self._acquire()
+            response = None
+            throttled = False
+            try:
+                response = send(method, url, *args, **kwargs)
+                throttled = is_throttled(response)
+            finally:
+                self._release(response, throttled)
+            if not throttled or attempt >= self.max_retries:
+                if throttled:
+                    logger.warning(f"Giving up on {method} {url} after {attempt} throttled retries")
+                return response
+            delay = self._backoff(attempt, response)
+            RETRIES.inc(status=response.status_code)
+            THROTTLE_WAIT.observe(delay)
+            logger.info(f"Canvas throttled {method} {url}; retrying in {delay:.2f}s "
+                        f"(concurrency {self.limit}, remaining {self.remaining})")
+            attempt += 1
+
+    def idle_for(self, now):
+        """Seconds since the last request ended, None while requests are in flight or waiting"""
+        with self.condition:
+            if self.in_flight or self.waiting:
+                return None
+            return now - self.used_at
+
+
+_schedulers = {}
+_sessions = {}
+_schedulers_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # Pooled connections and held locks can't be shared with a worker forked
+    # from a preloaded app; it starts with its own sessions and schedulers
+    global _schedulers_lock
+    _schedulers.clear()
+    _sessions.clear()
+    _schedulers_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _credential_key(API_URL, API_KEY):
+    return API_URL + '|' + hashlib.sha256(API_KEY.encode('utf-8')).hexdigest()
+
+
+def _evict_idle():
+    """Close the sessions of credentials that are no longer being used
+
+    Called with _schedulers_lock held, before a credential is added.
+    Credentials with requests in flight or waiting are never evicted, so
+    parses sharing a token keep sharing its scheduler.
+    """
+    now = time.monotonic()
+    # Room for the credential about to be added
+    excess = len(_schedulers) + 1 - SESSION_CACHE_SIZE
+    for key in sorted(_schedulers, key=lambda key: _schedulers[key].used_at):
+        idle_for = _schedulers[key].idle_for(now)
+        if idle_for is None or (excess <= 0 and idle_for <= SESSION_IDLE_TIMEOUT):
+            continue
+        del _schedulers[key]
+        excess -= 1
+        session = _sessions.pop(key, None)
+        if session is not None:
+            session.close()
+
+
+def scheduler_for(API_URL, API_KEY):
+    """The process-wide scheduler of a Canvas instance and token"""
+    key = _credential_key(API_URL, API_KEY)
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            _evict_idle()
+            scheduler = _schedulers[key] = TokenScheduler()
+        return scheduler
+
+
+def schedule_session(session, scheduler):
+    """Route every request of a requests session through scheduler"""
+    send = session.request
+
+    def request(method, url, *args, **kwargs):
+        return scheduler.request(send, method, url, *args, **kwargs)
+
+    session.request = request
+    return session
+
+
+def session_for(API_URL, API_KEY):
+    """The keep-alive session shared by every Canvas client of a credential
+
+    Its connection pool holds as many connections as the scheduler lets
+    requests run at once, so parses of many courses reuse the same TCP/TLS
+    connections. Requests are counted in metrics and go through the
+    credential's scheduler. Sessions of credentials that stop being used
+    are closed (see SESSION_CACHE_SIZE).
+    """
+    # requests is imported here, on first use, to keep it out of app startup
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    scheduler = scheduler_for(API_URL, API_KEY)
+    key = _credential_key(API_URL, API_KEY)
+    with _schedulers_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=scheduler.max_concurrency)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            instrument_session(session)
+            schedule_session(session, scheduler)
+            _sessions[key] = session
+        return session
+
+
+class SessionView:
+    """One client's handle on a shared session
+
+    canvasapi only calls get/post/put/patch/delete on its session. The view
+    forwards them to the shared session and, given a StageTimer, adds each
+    call (throttling waits included) to its canvas_api stage.
+    """
+
+    def __init__(self, session, timer=None):
+        self.session = session
+        self.timer = timer
+
+    def request(self, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.session.request(method, url, **kwargs)
+        finally:
+            if self.timer is not None:
+                self.timer.record('canvas_api', time.perf_counter() - start, observe=False)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
@@ -0,0 +1,269 @@
+import hashlib
+import html
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+import sqlite_db
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# bm25 weights of the indexed columns: title, description, module, course_name
+COLUMN_WEIGHTS = (10.0, 1.0, 3.0, 2.0)
+
+# Most tokens of text in a result's snippet (FTS5 allows up to 64)
+SNIPPET_TOKENS = 24
+
+# Private-use characters FTS5 puts around matches; they become <mark> tags
+# once the snippet's text is escaped, so course text never reaches a page
+# as markup
+MATCH_START = '\ue000'
+MATCH_END = '\ue001'
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def snippet_html(snippet):
+    """HTML of a snippet: its text escaped, its matches in <mark> tags"""
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+
+def credential_scope(api_url, api_key):
+    """Identify whose exports a search may see: one token on one Canvas"""
+    token_hash = hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+    return f"{api_url}|{token_hash}"
+
+
+def match_query(text):
+    """Turn free text into an FTS5 query matching items with every word
+
+    Words are quoted, so FTS5 operators and punctuation in the text are
+    searched for literally, and the last word also matches as a prefix for
+    search-as-you-type. Returns None when the text has no words.
+    """
+    words = WORD.findall(text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+class SearchIndex:
+    """SQLite FTS5 index of parsed item text, filled as courses are parsed
+
+    Item metadata lives in a plain documents table and the searchable text
+    in an FTS5 table sharing its rowids. Rows written by a parse carry that
+    parse's generation and replace the course's previous rows only when the
+    parse finishes, so a course stays searchable while it is re-parsed and a
+    parse that fails leaves the previous rows in place.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite_db.connect(path)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                scope TEXT NOT NULL,
+                course_id INTEGER NOT NULL,
+                generation TEXT NOT NULL,
+                course_name TEXT,
+                module_position INTEGER,
+                module TEXT,
+                item_position INTEGER,
+                type TEXT,
+                title TEXT,
+                due_date TEXT,
+                download_link TEXT,
+                file_type TEXT
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS documents_course ON documents (scope, course_id, generation)')
+        self.conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS items USING fts5(
+                title, description, module, course_name,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS courses (
+                scope TEXT NOT NULL,
+                course_id INTEGER NOT NULL,
+                course_name TEXT,
+                generation TEXT NOT NULL,
+                total_items INTEGER NOT NULL,
+                indexed_at REAL NOT NULL,
+                PRIMARY KEY (scope, course_id)
+            )
+        ''')
+        self.conn.commit()
+        sqlite_db.reopen_after_fork(self)
+
+    def course_writer(self, scope, course_id, course_name):
+        """Start indexing a parse of a course; see CourseIndexWriter"""
+        return CourseIndexWriter(self, scope, course_id, course_name)
+
+    def _add_module(self, writer, module_position, module_dict):
+        with self.lock:
+            for item_position, item in enumerate(module_dict['items']):
+                cursor = self.conn.execute(
+                    'INSERT INTO documents (scope, course_id, generation, course_name, module_position, module, '
+                    'item_position, type, title, due_date, download_link, file_type) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (writer.scope, writer.course_id, writer.generation, writer.course_name, module_position,
+                     module_dict['title'], item_position, item.get('type'), item.get('title'),
+                     item.get('due_date'), item.get('download_link'), item.get('file_type'))
+                )
+                self.conn.execute(
+                    'INSERT INTO items (rowid, title, description, module, course_name) VALUES (?, ?, ?, ?, ?)',
+                    (cursor.lastrowid, item.get('title') or '', item.get('description') or '',
+                     module_dict['title'] or '', writer.course_name or '')
+                )
+            self.conn.commit()
+
+    def _delete_rows(self, scope, course_id, where, generation):
+        self.conn.execute(
+            'DELETE FROM items WHERE rowid IN '
+            f'(SELECT id FROM documents WHERE scope = ? AND course_id = ? AND generation {where} ?)',
+            (scope, course_id, generation)
+        )
+        self.conn.execute(f'DELETE FROM documents WHERE scope = ? AND course_id = ? AND generation {where} ?',
+                          (scope, course_id, generation))
+
+    def _commit_course(self, writer):
+        with self.lock:
+            self._delete_rows(writer.scope, writer.course_id, '!=', writer.generation)
+            self.conn.execute(
+                'INSERT OR REPLACE INTO courses VALUES (?, ?, ?, ?, ?, ?)',
+                (writer.scope, writer.course_id, writer.course_name, writer.generation, writer.total_items,
+                 time.time())
+            )
+            self.conn.commit()
+
+    def _abort_course(self, writer):
+        with self.lock:
+            self._delete_rows(writer.scope, writer.course_id, '=', writer.generation)
+            self.conn.commit()
+
+    def search(self, scope, text, offset=0, limit=DEFAULT_LIMIT, course_ids=None, types=None):
+        """Return (results, has_more) for items of scope matching text, best first
+
+        Each result has the item's fields, its course and module, a snippet
+        of the best matching column as HTML (the text escaped, matches
+        wrapped in <mark> tags), and its bm25 score (lower ranks higher).
+        """
+        query = match_query(text)
+        if query is None:
+            return [], False
+        filters = ''
+        params = [query, scope]
+        if course_ids:
+            filters += f" AND d.course_id IN ({', '.join('?' for _ in course_ids)})"
+            params.extend(course_ids)
+        if types:
+            filters += f" AND d.type IN ({', '.join('?' for _ in types)})"
+            params.extend(types)
+        params.extend([limit + 1, offset])
+
+        weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS)
+        # Rows of a parse still in progress or abandoned have no course
+        # record with their generation yet, so they don't show up twice
+        sql = f'''
+            SELECT d.course_id, d.course_name, d.module_position, d.module, d.item_position, d.type, d.title,
+                   d.due_date, d.download_link, d.file_type,
+                   snippet(items, -1, '{MATCH_START}', '{MATCH_END}', '…', {SNIPPET_TOKENS}) AS snippet,
+                   bm25(items, {weights}) AS score
+            FROM items
+            JOIN documents d ON d.id = items.rowid
+            JOIN courses c ON c.scope = d.scope AND c.course_id = d.course_id AND c.generation = d.generation
+            WHERE items MATCH ? AND d.scope = ?{filters}
+            ORDER BY score
+            LIMIT ? OFFSET ?
+        '''
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+
+        columns = ('course_id', 'course_name', 'module_position', 'module', 'item_position', 'type', 'title',
+                   'due_date', 'download_link', 'file_type', 'snippet', 'score')
+        results = [dict(zip(columns, row)) for row in rows[:limit]]
+        for result in results:
+            result['snippet'] = snippet_html(result['snippet'])
+        return results, len(rows) > limit
+
+    def stats(self, scope=None):
+        with self.lock:
+            if scope is None:
+                courses, items = self.conn.execute(
+                    'SELECT COUNT(*), COALESCE(SUM(total_items), 0) FROM courses').fetchone()
+            else:
+                courses, items = self.conn.execute(
+                    'SELECT COUNT(*), COALESCE(SUM(total_items), 0) FROM courses WHERE scope = ?',
+                    (scope,)
+                ).fetchone()
+        return {'courses': courses, 'items': items}
+
+
+class CourseIndexWriter:
+    """Index one parse of a course module by module
+
+    Call add_module from the on_module callback of write_course_json or
+    write_course_rows, then commit once the parse finished, or abort if it
+    failed. Search is secondary to the export, so an error while indexing
+    is logged and leaves the course's previous entries in place rather
+    than failing the parse.
+    """
+
+    def __init__(self, index, scope, course_id, course_name):
+        self.index = index
+        self.scope = scope
+        self.course_id = course_id
+        self.course_name = course_name
+        self.generation = uuid.uuid4().hex
+        self.modules_count = 0
+        self.total_items = 0
+        self.failed = False
+
+    def add_module(self, module_dict):
+        if self.failed:
+            return
+        try:
+            self.index._add_module(self, self.modules_count, module_dict)
+        except Exception as e:
+            logger.warning(f"Error indexing course {self.course_id} for search: {e}")
+            self.failed = True
+            return
+        self.modules_count += 1
+        self.total_items += len(module_dict['items'])
+
+    def commit(self):
+        if self.failed:
+            self.abort()
+            return
+        try:
+            self.index._commit_course(self)
+        except Exception as e:
+            logger.warning(f"Error indexing course {self.course_id} for search: {e}")
+            return
+        logger.info(f"Indexed {self.total_items} items of course {self.course_id} for search")
+
+    def abort(self):
+        try:
+            self.index._abort_course(self)
+        except Exception as e:
+            logger.warning(f"Error discarding search entries of course {self.course_id}: {e}")
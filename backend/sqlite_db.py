@@ -0,0 +1,31 @@
+import os
+import sqlite3
+import threading
+
+# Seconds a connection waits for another process's write lock before failing
+BUSY_TIMEOUT = 30
+
+
+def connect(path):
+    """Open a WAL-mode connection to path, shared by the process's threads
+
+    Callers serialize its use with a lock of their own.
+    """
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def reopen_after_fork(owner):
+    """Give owner a new connection and lock in every forked child
+
+    owner has path, conn and lock attributes. A worker forked from a
+    preloaded app can't share the parent's connection, or a lock the
+    parent may have held while forking.
+    """
+    def reopen():
+        owner.lock = threading.Lock()
+        owner.conn = connect(owner.path)
+
+    os.register_at_fork(after_in_child=reopen)
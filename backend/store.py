@@ -0,0 +1,225 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Expired entries are swept out after this many writes
+PURGE_EVERY = 200
+
+
+def _expires_at(ttl):
+    return time.time() + ttl if ttl else None
+
+
+class MemoryStore:
+    """Expiring key/value store living in this process only
+
+    Values are kept JSON-encoded, so callers get a fresh copy on every read
+    and the same values work with SQLiteStore.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def _live(self, namespace, key, now):
+        entry = self.entries.get((namespace, key))
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            del self.entries[(namespace, key)]
+            return None
+        return entry
+
+    def get(self, namespace, key):
+        with self.lock:
+            entry = self._live(namespace, key, time.time())
+        return None if entry is None else json.loads(entry[0])
+
+    def set(self, namespace, key, value, ttl=None):
+        with self.lock:
+            self.entries[(namespace, key)] = (json.dumps(value), _expires_at(ttl))
+            self._written()
+
+    def add(self, namespace, key, value, ttl=None):
+        """Store value unless the key is already set; True if it was stored"""
+        with self.lock:
+            if self._live(namespace, key, time.time()) is not None:
+                return False
+            self.entries[(namespace, key)] = (json.dumps(value), _expires_at(ttl))
+            self._written()
+            return True
+
+    def delete(self, namespace, key):
+        with self.lock:
+            self.entries.pop((namespace, key), None)
+
+    def _written(self):
+        self.writes += 1
+        if self.writes % PURGE_EVERY == 0:
+            now = time.time()
+            expired = [k for k, (_, expires_at) in self.entries.items() if expires_at is not None and expires_at <= now]
+            for k in expired:
+                del self.entries[k]
+
+
+class SQLiteStore:
+    """Expiring key/value store in an SQLite file shared by processes
+
+    Every gunicorn worker on one host sees the same entries. The file must
+    be on a local disk: WAL mode keeps its index in shared memory, and
+    SQLite's locking can't be relied on over network filesystems, so
+    replicas on other hosts can't share it. Connections are opened per
+    process, so a store created before the server forks its workers keeps
+    working.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.pid = None
+        self.writes = 0
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _connection(self):
+        if self.conn is None or self.pid != os.getpid():
+            # First use, or first use in a worker forked from a preloaded app;
+            # isolation_level=None leaves transactions to BEGIN IMMEDIATE below
+            self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            self.pid = os.getpid()
+            # Sessions keep Canvas tokens here; SQLite gives the -wal and
+            # -shm files the database file's permissions
+            os.chmod(self.path, 0o600)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL,
+                    PRIMARY KEY (namespace, key)
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at)')
+        return self.conn
+
+    def get(self, namespace, key):
+        with self.lock:
+            row = self._connection().execute(
+                'SELECT value FROM entries WHERE namespace = ? AND key = ? '
+                'AND (expires_at IS NULL OR expires_at > ?)',
+                (namespace, key, time.time())
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set(self, namespace, key, value, ttl=None):
+        with self.lock:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                (namespace, key, json.dumps(value), _expires_at(ttl))
+            )
+            self._written(conn)
+
+    def add(self, namespace, key, value, ttl=None):
+        """Store value unless the key is already set; True if it was stored
+
+        The check and insert run in one write transaction, so exactly one
+        process wins when several add the same key at once.
+        """
+        with self.lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    'DELETE FROM entries WHERE namespace = ? AND key = ? AND expires_at <= ?',
+                    (namespace, key, time.time())
+                )
+                cursor = conn.execute(
+                    'INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?)',
+                    (namespace, key, json.dumps(value), _expires_at(ttl))
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            stored = cursor.rowcount == 1
+            if stored:
+                self._written(conn)
+            return stored
+
+    def delete(self, namespace, key):
+        with self.lock:
+            self._connection().execute('DELETE FROM entries WHERE namespace = ? AND key = ?', (namespace, key))
+
+    def _written(self, conn):
+        self.writes += 1
+        if self.writes % PURGE_EVERY == 0:
+            cursor = conn.execute('DELETE FROM entries WHERE expires_at <= ?', (time.time(),))
+            if cursor.rowcount:
+                logger.info(f"Purged {cursor.rowcount} expired entries from {self.path}")
+
+
+class Namespace:
+    """Dict-style view of one namespace of a store, with a default ttl
+
+    With hash_keys, keys are stored as their SHA-256, for keys that are
+    secrets themselves such as session ids: whoever can read the store
+    can't use them, while lookups by the key still work.
+    """
+
+    def __init__(self, store, name, ttl=None, hash_keys=False):
+        self.store = store
+        self.name = name
+        self.ttl = ttl
+        self.hash_keys = hash_keys
+
+    def _key(self, key):
+        return hashlib.sha256(key.encode('utf-8')).hexdigest() if self.hash_keys else key
+
+    def get(self, key, default=None):
+        value = self.store.get(self.name, self._key(key))
+        return default if value is None else value
+
+    def set(self, key, value, ttl=None):
+        self.store.set(self.name, self._key(key), value, ttl if ttl is not None else self.ttl)
+
+    def add(self, key, value, ttl=None):
+        return self.store.add(self.name, self._key(key), value, ttl if ttl is not None else self.ttl)
+
+    def __contains__(self, key):
+        return self.store.get(self.name, self._key(key)) is not None
+
+    def __getitem__(self, key):
+        value = self.store.get(self.name, self._key(key))
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        self.store.delete(self.name, self._key(key))
+
+
+def make_store(backend, path=None):
+    """Create the store named by backend: 'memory' or 'sqlite' (at path)"""
+    if backend == 'memory':
+        return MemoryStore()
+    if backend == 'sqlite':
+        return SQLiteStore(path)
+    raise ValueError(f"Unknown store backend: {backend}")
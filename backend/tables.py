@@ -0,0 +1,364 @@
+"""Flat table exports of parsed courses, for analytics over many courses
+
+Every item becomes one row of the items table. SQLite files also get a
+courses table with one row per exported course and a failed_items table
+listing the items that couldn't be exported, and can be reopened to
+append more courses. Parquet files need the optional pyarrow package and
+are written in row groups while the writer is open; a Parquet file holds
+one table, so failed items are rows of it with the error column set.
+
+Existing JSON and NDJSON exports can be converted without re-parsing:
+
+    python -m tables downloads/*.json --output courses.sqlite
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from canvas import module_to_dict
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Table export formats and the extension of their files
+TABLE_FORMATS = {'sqlite': '.sqlite', 'parquet': '.parquet'}
+
+# Columns of the items table, in order
+COLUMNS = ('course_id', 'course_name', 'module_position', 'module', 'item_position', 'type', 'title',
+           'description', 'due_date', 'download_link', 'file_type')
+
+# Parquet files add the error of failed items, which is NULL for items
+PARQUET_COLUMNS = COLUMNS + ('error',)
+
+# Integer columns; every other column is text
+INTEGER_COLUMNS = ('course_id', 'module_position', 'item_position')
+
+# Exports write "NA" for fields an item type doesn't have; tables use NULL
+OPTIONAL_COLUMNS = ('due_date', 'download_link', 'file_type')
+
+# Rows buffered before they are written as one transaction or row group
+BATCH_SIZE = int(os.environ.get('TABLE_EXPORT_BATCH_SIZE', 5000))
+
+
+def module_rows(course_id, course_name, module_position, module_dict):
+    """Flatten one exported module dict into item rows"""
+    rows = []
+    for item_position, item in enumerate(module_dict['items']):
+        row = {
+            'course_id': course_id,
+            'course_name': course_name,
+            'module_position': module_position,
+            'module': module_dict['title'],
+            'item_position': item_position
+        }
+        for column in COLUMNS[5:]:
+            value = item.get(column)
+            row[column] = None if column in OPTIONAL_COLUMNS and value in ('NA', None) else value
+        rows.append(row)
+    return rows
+
+
+def failed_item_row(course_id, course_name, failed):
+    """Row of an item that couldn't be exported, for the Parquet items table"""
+    row = dict.fromkeys(PARQUET_COLUMNS)
+    row.update(course_id=course_id, course_name=course_name, module=failed['module'], type=failed['type'],
+               title=failed['title'], error=failed['error'])
+    return row
+
+
+class SQLiteTableWriter:
+    """Append courses to an SQLite file with items and courses tables
+
+    A course written again replaces its earlier rows, so one file can be
+    kept up to date across many exports. Items are indexed by course, type
+    and due date.
+    """
+
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = []
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        columns = ', '.join(f"{column} {'INTEGER' if column in INTEGER_COLUMNS else 'TEXT'}" for column in COLUMNS)
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS items ({columns})')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS items_course ON items (course_id, module_position, item_position)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS items_type ON items (type)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS items_due_date ON items (due_date)')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS courses (
+                course_id INTEGER PRIMARY KEY,
+                course_name TEXT,
+                modules_count INTEGER,
+                total_items INTEGER,
+                exported_at TEXT
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS failed_items (
+                course_id INTEGER,
+                module_id INTEGER,
+                module TEXT,
+                item_id INTEGER,
+                type TEXT,
+                title TEXT,
+                content_id INTEGER,
+                error TEXT
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS failed_items_course ON failed_items (course_id)')
+        self.conn.commit()
+
+    def begin_course(self, course_id):
+        with self.lock:
+            self._flush()
+            self.conn.execute('DELETE FROM items WHERE course_id = ?', (course_id,))
+            self.conn.execute('DELETE FROM courses WHERE course_id = ?', (course_id,))
+            self.conn.execute('DELETE FROM failed_items WHERE course_id = ?', (course_id,))
+            self.conn.commit()
+
+    def append(self, rows):
+        with self.lock:
+            self.pending.extend(rows)
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+
+    def abort_course(self, course_id):
+        """Drop the rows of a course whose parse failed partway"""
+        with self.lock:
+            self.pending = [row for row in self.pending if row['course_id'] != course_id]
+            self.conn.execute('DELETE FROM items WHERE course_id = ?', (course_id,))
+            self.conn.execute('DELETE FROM courses WHERE course_id = ?', (course_id,))
+            self.conn.execute('DELETE FROM failed_items WHERE course_id = ?', (course_id,))
+            self.conn.commit()
+
+    def end_course(self, course_id, course_name, modules_count, total_items, failed_items=()):
+        with self.lock:
+            self._flush()
+            self.conn.execute('INSERT OR REPLACE INTO courses VALUES (?, ?, ?, ?, ?)',
+                              (course_id, course_name, modules_count, total_items, datetime.now().isoformat()))
+            self.conn.executemany(
+                'INSERT INTO failed_items VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(course_id, failed['module_id'], failed['module'], failed['item_id'], failed['type'],
+                  failed['title'], failed['content_id'], failed['error']) for failed in failed_items]
+            )
+            self.conn.commit()
+
+    def _flush(self):
+        if not self.pending:
+            return
+        placeholders = ', '.join('?' for _ in COLUMNS)
+        self.conn.executemany(f'INSERT INTO items VALUES ({placeholders})',
+                              [tuple(row[column] for column in COLUMNS) for row in self.pending])
+        self.conn.commit()
+        self.pending = []
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.conn.close()
+
+
+class ParquetTableWriter:
+    """Write items to a Parquet file, one row group per batch
+
+    Courses can be appended until the writer is closed; a Parquet file
+    can't be changed after that. Row groups already written can't be
+    dropped either, so when a course is aborted after some of its rows
+    were written, the file is rewritten without them on close.
+    """
+
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        if not format_available('parquet'):
+            raise ValueError('Parquet export needs the pyarrow package')
+        # pyarrow is large and optional, so it is only imported when used
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+
+        self.pyarrow = pyarrow
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = []
+        self.written_courses = set()
+        self.aborted_courses = set()
+        self.lock = threading.Lock()
+        self.schema = pyarrow.schema([
+            (column, pyarrow.int64() if column in INTEGER_COLUMNS else pyarrow.string())
+            for column in PARQUET_COLUMNS
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def begin_course(self, course_id):
+        pass
+
+    def append(self, rows):
+        with self.lock:
+            self.pending.extend(rows)
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+
+    def abort_course(self, course_id):
+        """Drop the rows of a course whose parse failed partway"""
+        with self.lock:
+            self.pending = [row for row in self.pending if row['course_id'] != course_id]
+            self.aborted_courses.add(course_id)
+
+    def end_course(self, course_id, course_name, modules_count, total_items, failed_items=()):
+        # Failed items follow the course's items, with module_position and
+        # item_position NULL and error set
+        self.append([failed_item_row(course_id, course_name, failed) for failed in failed_items])
+
+    def _flush(self):
+        if not self.pending:
+            return
+        columns = {column: [row.get(column) for row in self.pending] for column in PARQUET_COLUMNS}
+        self.writer.write_table(self.pyarrow.Table.from_pydict(columns, schema=self.schema))
+        self.written_courses.update(row['course_id'] for row in self.pending)
+        self.pending = []
+
+    def _drop_aborted(self):
+        pyarrow = self.pyarrow
+        aborted = pyarrow.array(sorted(self.aborted_courses), pyarrow.int64())
+        tmp_path = f"{self.path}.tmp"
+        with open(self.path, 'rb') as f:
+            source = pyarrow.parquet.ParquetFile(f)
+            with pyarrow.parquet.ParquetWriter(tmp_path, self.schema) as writer:
+                for batch in source.iter_batches(batch_size=self.batch_size):
+                    table = pyarrow.Table.from_batches([batch], schema=self.schema)
+                    keep = pyarrow.compute.invert(pyarrow.compute.is_in(table['course_id'], value_set=aborted))
+                    writer.write_table(table.filter(keep))
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.writer.close()
+            if self.aborted_courses & self.written_courses:
+                self._drop_aborted()
+
+
+def open_table_writer(fmt, path, batch_size=BATCH_SIZE):
+    """Open a writer for a TABLE_FORMATS format, appending to path for sqlite"""
+    if fmt == 'sqlite':
+        return SQLiteTableWriter(path, batch_size)
+    if fmt == 'parquet':
+        return ParquetTableWriter(path, batch_size)
+    raise ValueError(f"Unsupported table format: {fmt}")
+
+
+def format_available(fmt):
+    """Whether the packages a table format needs are installed"""
+    return fmt != 'parquet' or importlib.util.find_spec('pyarrow') is not None
+
+
+def write_course_rows(course_obj, writer, on_module=None):
+    """Append a course's items to a table writer as its modules are parsed
+
+    Returns the same counts as write_course_json; on_module is called with
+    each module's dict as it is parsed. Failed items go to the SQLite
+    failed_items table, or to Parquet rows with the error column set.
+    """
+    stats = {'modules_count': 0, 'total_items': 0}
+    course_name = getattr(course_obj.course, 'name', 'Unknown Course')
+    timer = course_obj.timings
+    writer.begin_course(course_obj.course_id)
+    for module in course_obj.iter_modules():
+        with timer.stage('serialize'):
+            try:
+                module_dict = module_to_dict(module)
+            except Exception as e:
+                logger.warning(f"Error processing module: {e}")
+                continue
+            del module
+
+            if on_module is not None:
+                on_module(module_dict)
+            rows = module_rows(course_obj.course_id, course_name, stats['modules_count'], module_dict)
+        with timer.stage('write'):
+            writer.append(rows)
+
+        stats['modules_count'] += 1
+        stats['total_items'] += len(rows)
+    failed_items = getattr(course_obj, 'failed_items', [])
+    stats['failed_items'] = len(failed_items)
+    writer.end_course(course_obj.course_id, course_name, stats['modules_count'], stats['total_items'], failed_items)
+    return stats
+
+
+def iter_export_modules(path, failed_items=None):
+    """Yield (course_id, course_name, module_dict) from a JSON or NDJSON export
+
+    The export's failed items are appended to the failed_items list if
+    given, by the time the last module was yielded.
+    """
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.ndjson'):
+            module = None
+            for line in f:
+                item = json.loads(line)
+                if 'error' in item:
+                    # Failed items are listed after the modules
+                    if failed_items is not None:
+                        del item['course_id'], item['course_name']
+                        failed_items.append(item)
+                    continue
+                key = (item.pop('course_id'), item.pop('course_name'), item.pop('module'))
+                if module is None or module[:3] != key:
+                    if module is not None:
+                        yield module[0], module[1], {'title': module[2], 'items': module[3]}
+                    module = key + ([],)
+                module[3].append(item)
+            if module is not None:
+                yield module[0], module[1], {'title': module[2], 'items': module[3]}
+        else:
+            export = json.load(f)
+            if failed_items is not None:
+                failed_items.extend(export.get('failed_items', []))
+            for module_dict in export['modules']:
+                yield export['course_id'], export['course_name'], module_dict
+
+
+def convert_exports(paths, writer):
+    """Append existing JSON/NDJSON export files to a table writer"""
+    for path in paths:
+        current = None
+        failed_items = []
+        for course_id, course_name, module_dict in iter_export_modules(path, failed_items):
+            if current is None:
+                current = {'course_id': course_id, 'course_name': course_name, 'modules': 0, 'items': 0}
+                writer.begin_course(course_id)
+            rows = module_rows(course_id, course_name, current['modules'], module_dict)
+            writer.append(rows)
+            current['modules'] += 1
+            current['items'] += len(rows)
+        if current is not None:
+            writer.end_course(current['course_id'], current['course_name'], current['modules'], current['items'],
+                              failed_items)
+            logger.info(f"Added {current['items']} items of course {current['course_id']} from {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert course exports to an SQLite or Parquet table')
+    parser.add_argument('exports', nargs='+', help='JSON or NDJSON export files')
+    parser.add_argument('--output', required=True, help='.sqlite file to create or append to, or .parquet file')
+    args = parser.parse_args()
+
+    fmt = 'parquet' if args.output.endswith('.parquet') else 'sqlite'
+    writer = open_table_writer(fmt, args.output)
+    try:
+        convert_exports(args.exports, writer)
+    finally:
+        writer.close()
+
+
+if __name__ == '__main__':
+    main()
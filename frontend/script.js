@@ -6,6 +6,8 @@ class CanvasExtractor {
         this.selectedCourseId = null;
         this.selectedCourseName = null;
         this.downloadUrl = null;
+        this.coursesRequest = 0;
+        this.eventStreams = false;
         
         this.init();
     }
@@ -27,6 +29,15 @@ class CanvasExtractor {
             }
         });
 
+        // Course search, sent to the server once typing pauses
+        const courseSearch = document.getElementById('courseSearch');
+        if (courseSearch) {
+            courseSearch.addEventListener('input', () => {
+                clearTimeout(this.searchTimer);
+                this.searchTimer = setTimeout(() => this.loadCourses(), 300);
+            });
+        }
+
         // Download button
         const downloadBtn = document.getElementById('downloadBtn');
         if (downloadBtn) {
@@ -102,6 +113,7 @@ class CanvasExtractor {
 
             if (result.success) {
                 this.sessionId = result.session_id;
+                this.eventStreams = Boolean(result.event_streams);
                 this.showSuccess(result.message);
                 setTimeout(() => this.goToStep(2), 1000);
             } else {
@@ -116,43 +128,66 @@ class CanvasExtractor {
         }
     }
 
-    // Load courses
+    // Load courses: show the first page as soon as it arrives, then append the rest
     async loadCourses() {
         const coursesLoading = document.getElementById('coursesLoading');
         const coursesList = document.getElementById('coursesList');
+        const courseSearch = document.getElementById('courseSearch');
+        const search = courseSearch ? courseSearch.value.trim() : '';
+        // A newer search or reload supersedes pages still being fetched
+        const requestId = ++this.coursesRequest;
         
-        coursesLoading.style.display = 'block';
-        coursesList.style.display = 'none';
+        if (coursesList.style.display === 'none') {
+            coursesLoading.style.display = 'block';
+        }
 
         try {
-            const response = await fetch('/api/courses', {
-                method: 'GET',
-                headers: {
-                    'Session-Id': this.sessionId
+            let page = 1;
+            let hasMore = true;
+            while (hasMore) {
+                const params = new URLSearchParams({ page, limit: 50 });
+                if (search) {
+                    params.set('search', search);
+                }
+                const response = await fetch(`/api/courses?${params}`, {
+                    method: 'GET',
+                    headers: {
+                        'Session-Id': this.sessionId
+                    }
+                });
+
+                const result = await response.json();
+                if (requestId !== this.coursesRequest) {
+                    return;
                 }
-            });
 
-            const result = await response.json();
+                if (!result.success) {
+                    this.showError(result.message);
+                    this.goToStep(1);
+                    return;
+                }
 
-            if (result.success) {
-                this.renderCourses(result.courses);
+                this.renderCourses(result.courses, page > 1);
                 coursesLoading.style.display = 'none';
                 coursesList.style.display = 'block';
-            } else {
-                this.showError(result.message);
-                this.goToStep(1);
+                hasMore = result.has_more;
+                page += 1;
             }
         } catch (error) {
-            this.showError('Failed to load courses. Please try again.');
-            this.goToStep(1);
+            if (requestId === this.coursesRequest) {
+                this.showError('Failed to load courses. Please try again.');
+                this.goToStep(1);
+            }
         }
     }
 
-    renderCourses(courses) {
+    renderCourses(courses, append = false) {
         const container = document.getElementById('coursesContainer');
-        container.innerHTML = '';
+        if (!append) {
+            container.innerHTML = '';
+        }
 
-        if (courses.length === 0) {
+        if (courses.length === 0 && !append) {
             container.innerHTML = '<p style="text-align: center; padding: 40px; color: #6c757d;">No courses found.</p>';
             return;
         }
@@ -162,6 +197,9 @@ class CanvasExtractor {
             courseItem.className = 'course-item';
             courseItem.dataset.courseId = course.id;
             courseItem.dataset.courseName = course.name;
+            if (String(course.id) === this.selectedCourseId) {
+                courseItem.classList.add('selected');
+            }
 
             const statusClass = course.workflow_state === 'available' ? 'available' : 'unpublished';
             
@@ -208,37 +246,187 @@ class CanvasExtractor {
 
     async parseCourse() {
         const parsingMessage = document.getElementById('parsingMessage');
+        const parsedModules = document.getElementById('parsedModules');
+        parsedModules.innerHTML = '';
         
         try {
             parsingMessage.textContent = `Parsing "${this.selectedCourseName}"...`;
 
-            const response = await fetch('/api/parse-course', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'Session-Id': this.sessionId
-                },
-                body: JSON.stringify({
-                    course_id: parseInt(this.selectedCourseId)
-                })
-            });
-
-            const result = await response.json();
+            let stream = {};
+            // Without event streams enabled on the server the job is polled below
+            if (this.eventStreams) {
+                try {
+                    const response = await fetch(`/api/parse-course/${parseInt(this.selectedCourseId)}/events`, {
+                        method: 'GET',
+                        headers: {
+                            'Session-Id': this.sessionId
+                        }
+                    });
+
+                    if (response.status === 400 || response.status === 401) {
+                        const result = await response.json();
+                        this.showError(result.message);
+                        this.goToStep(2);
+                        return;
+                    }
+
+                    if (response.ok) {
+                        stream = await this.readParseEvents(response, stream);
+                    }
+                } catch (error) {
+                    // The stream broke off; the job keeps running and is polled below
+                }
+            }
 
-            if (result.success) {
-                this.downloadUrl = result.download_url;
-                this.showParsingResults(result);
-                setTimeout(() => this.goToStep(4), 1000);
-            } else {
-                this.showError(result.message);
+            if (stream.error) {
+                this.showError(stream.error);
                 this.goToStep(2);
+                return;
             }
+
+            let result = stream.result;
+            if (!result) {
+                const job = stream.jobId ? await this.pollJob(stream.jobId) : await this.startParseJob();
+                if (job.state !== 'completed') {
+                    this.showError(job.error || job.message || 'Failed to parse course.');
+                    this.goToStep(2);
+                    return;
+                }
+                result = job.result;
+            }
+
+            this.downloadUrl = result.download_url;
+            this.showParsingResults(result);
+            setTimeout(() => this.goToStep(4), 1000);
         } catch (error) {
             this.showError('Failed to parse course. Please try again.');
             this.goToStep(2);
         }
     }
 
+    // Queue the parse as a plain job when the event stream isn't available
+    async startParseJob() {
+        const response = await fetch('/api/parse-course', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Session-Id': this.sessionId
+            },
+            body: JSON.stringify({
+                course_id: parseInt(this.selectedCourseId)
+            })
+        });
+
+        const result = await response.json();
+
+        if (!result.success) {
+            return result;
+        }
+
+        return this.pollJob(result.job_id);
+    }
+
+    // Poll a parse job until it finishes, showing its progress
+    async pollJob(jobId) {
+        const parsingMessage = document.getElementById('parsingMessage');
+
+        while (true) {
+            const response = await fetch(`/api/jobs/${jobId}`, {
+                method: 'GET',
+                headers: {
+                    'Session-Id': this.sessionId
+                }
+            });
+
+            const job = await response.json();
+
+            if (!job.success || job.state === 'completed' || job.state === 'failed') {
+                return job;
+            }
+
+            const progress = job.progress || {};
+            if (progress.modules_total !== undefined) {
+                parsingMessage.textContent = `Parsing "${this.selectedCourseName}"... ` +
+                    `${progress.modules_done} of ${progress.modules_total} modules, ` +
+                    `${progress.items_done} of ${progress.items_total} items processed`;
+            }
+
+            await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+    }
+
+    // Read the parse's Server-Sent Events, rendering each module as it arrives.
+    // Fills in stream.jobId from the first event, then stream.result with the
+    // final summary or stream.error with the failure. Returns stream with
+    // neither when the connection closes early; the job can then be polled.
+    async readParseEvents(response, stream) {
+        const parsingMessage = document.getElementById('parsingMessage');
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let moduleList = null;
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                return stream;
+            }
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                let data = '';
+                block.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) {
+                        event = line.slice(7);
+                    } else if (line.startsWith('data: ')) {
+                        data += line.slice(6);
+                    }
+                });
+                if (!data) {
+                    continue;
+                }
+                const payload = JSON.parse(data);
+
+                if (event === 'job') {
+                    stream.jobId = payload.job_id;
+                } else if (event === 'module') {
+                    moduleList = this.renderParsedModule(payload);
+                } else if (event === 'item' && moduleList) {
+                    const itemEntry = document.createElement('li');
+                    itemEntry.textContent = `${payload.type}: ${payload.title}`;
+                    moduleList.appendChild(itemEntry);
+                } else if (event === 'progress' && payload.modules_total !== undefined) {
+                    parsingMessage.textContent = `Parsing "${this.selectedCourseName}"... ` +
+                        `${payload.modules_done} of ${payload.modules_total} modules, ` +
+                        `${payload.items_done} of ${payload.items_total} items processed`;
+                } else if (event === 'done') {
+                    stream.result = payload;
+                    return stream;
+                } else if (event === 'error') {
+                    stream.error = payload.message;
+                    return stream;
+                }
+            }
+        }
+    }
+
+    renderParsedModule(module) {
+        const parsedModules = document.getElementById('parsedModules');
+        const moduleEntry = document.createElement('details');
+        moduleEntry.className = 'parsed-module';
+        moduleEntry.innerHTML = `
+            <summary>📁 ${this.escapeHtml(module.title)} <span class="parsed-count">(${module.items_count} items)</span></summary>
+            <ul></ul>
+        `;
+        parsedModules.appendChild(moduleEntry);
+        return moduleEntry.querySelector('ul');
+    }
+
     showParsingResults(result) {
         const resultsInfo = document.getElementById('resultsInfo');
         resultsInfo.innerHTML = `
@@ -255,6 +443,11 @@ class CanvasExtractor {
                 <span class="stat-label">Total Items:</span>
                 <span class="stat-value">${result.total_items}</span>
             </div>
+            ${result.failed_items && result.failed_items.length ? `
+            <div class="stat">
+                <span class="stat-label">Failed Items:</span>
+                <span class="stat-value">${result.failed_items.length} (listed under "failed_items" in the export)</span>
+            </div>` : ''}
             <div class="stat">
                 <span class="stat-label">File Name:</span>
                 <span class="stat-value">${this.escapeHtml(result.filename)}</span>
@@ -278,15 +471,6 @@ class CanvasExtractor {
 
     // Start over
     startOver() {
-        this.currentStep = 1;
-        this.sessionId = null;
-        this.selectedCourseId = null;
-        this.selectedCourseName = null;
-        this.downloadUrl = null;
-        
-        // Reset form
-        document.getElementById('authForm').reset();
-        
         // Clean up session if exists
         if (this.sessionId) {
             fetch('/api/cleanup', {
@@ -297,6 +481,15 @@ class CanvasExtractor {
             });
         }
         
+        this.currentStep = 1;
+        this.sessionId = null;
+        this.selectedCourseId = null;
+        this.selectedCourseName = null;
+        this.downloadUrl = null;
+        
+        // Reset form
+        document.getElementById('authForm').reset();
+        
         this.goToStep(1);
     }
 